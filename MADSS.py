@@ -36,9 +36,36 @@ from collections import defaultdict
 wd = os.getcwd()
 sys.path.insert(0, wd+'/madss_libraries/')
 
+# "--silent" sends all console output to /dev/null (the run report in
+# results/<AE>_run_report.json is still written)
+import madss_telemetry
+if '--silent' in sys.argv:
+    madss_telemetry.set_silent(True)
+    sys.argv.remove('--silent')
+
 import madss_credits
 madss_credits.print_intro()
 
+# Optional number of worker processes for parallel precomputations,
+# e.g. "python MADSS.py MI --processes=8" (0 uses all cores)
+processes = 1
+for arg in sys.argv[1:]:
+    if arg.startswith('--processes='):
+        processes = int(arg.split('=')[1]) or None
+        sys.argv.remove(arg)
+
+# "--import-legacy" imports the unversioned files in stored_vals into the
+# cache; only use it when they were computed for this interactome
+import madss_cache
+if '--import-legacy' in sys.argv:
+    madss_cache.IMPORT_LEGACY = True
+    sys.argv.remove('--import-legacy')
+
+# Connectivity functions run concurrently unless "--sequential" is given
+concurrent = '--sequential' not in sys.argv
+if not concurrent:
+    sys.argv.remove('--sequential')
+
 if len(sys.argv) < 2:
     sys.exit('Error: please specify an adverse event (e.g. "python MADSS.py MI"). Exiting.')
 
@@ -55,22 +82,22 @@ else:
 
 # ------ Load interactome ------
 import madss_interactome
-ppi, node_list, H = madss_interactome.load_network()
+with madss_telemetry.span('load_network'):
+    graph = madss_interactome.load_network()
 
 # ------ Assign seeds ------
-if ADVERSE_EVENT == 'MI':
-    seeds = ['ENSP00000358301','ENSP00000206249','ENSP00000366307','ENSP00000304236','ENSP00000287936','ENSP00000290866','ENSP00000392858','ENSP00000361125','ENSP00000258743','ENSP00000229135']
-elif ADVERSE_EVENT == 'Gastro':
-    seeds = ['ENSP00000287641','ENSP00000356438','ENSP00000366506','ENSP00000334145','ENSP00000354612','ENSP00000308541','ENSP00000218099','ENSP00000039007']
-elif ADVERSE_EVENT == 'Liver':
-    seeds = ['ENSP00000258743','ENSP00000295897','ENSP00000263341','ENSP00000308541','ENSP00000264708','ENSP00000356438','ENSP00000206249','ENSP00000412237','ENSP00000353483','ENSP00000356771','ENSP00000334145','ENSP00000351671','ENSP00000356694','ENSP00000216117','ENSP00000253408']
-elif ADVERSE_EVENT == 'Kidney':
-    seeds = ['ENSP00000360997', 'ENSP00000295897', 'ENSP00000265132', 'ENSP00000340858', 'ENSP00000379204', 'ENSP00000328173', 'ENSP00000241052', 'ENSP00000356399', 'ENSP00000265689', 'ENSP00000384400', 'ENSP00000360541', 'ENSP00000366124', 'ENSP00000377192', 'ENSP00000378408', 'ENSP00000338082', 'ENSP00000222390', 'ENSP00000287936', 'ENSP00000348170', 'ENSP00000298556', 'ENSP00000280357', 'ENSP00000265023', 'ENSP00000277480', 'ENSP00000229794', 'ENSP00000352835', 'ENSP00000365663', 'ENSP00000355759', 'ENSP00000265970', 'ENSP00000364252', 'ENSP00000234347', 'ENSP00000164139', 'ENSP00000360519', 'ENSP00000272190', 'ENSP00000367102', 'ENSP00000264938', 'ENSP00000368727']
-elif ADVERSE_EVENT == 'LQTS':
-    seeds = ['ENSP00000262186','ENSP00000155840','ENSP00000337255','ENSP00000290310','ENSP00000266483','ENSP00000348573','ENSP00000217381','ENSP00000328968','ENSP00000243457','ENSP00000266376','ENSP00000341940','ENSP00000349588','ENSP00000322460']
+import madss_seeds
+# phenotype names as used by the seed lists and gold standard files (e.g. "Gastro")
+ADVERSE_EVENT = dict((phenotype.upper(), phenotype) for phenotype in madss_seeds.PHENOTYPE_SEEDS).get(ADVERSE_EVENT, ADVERSE_EVENT)
+if ADVERSE_EVENT not in madss_seeds.PHENOTYPE_SEEDS:
+    sys.exit('Error: no seeds defined for %s. Exiting.' %ADVERSE_EVENT)
+seeds = madss_seeds.PHENOTYPE_SEEDS[ADVERSE_EVENT]
 
 print 'Number of seeds: ', len(seeds)
 
+# Integer-indexed graph with seed and complement masks, shared by all connectivity functions
+graph = graph.with_seeds(seeds)
+
 # ------ Prepare to calculate node connectivities ------
 Sj_scores = defaultdict(dict)
 
@@ -94,46 +121,46 @@ def read_Sj_file(METRIC):
 
     return Sj_from_file
 
+# Columnar results from an earlier run (see madss_libraries/madss_results.py).
+# The per-function text files record neither the seed set nor the
+# interactome, so they are only read when no results file exists at all:
+# if one was rejected as stale, the text files come from the same run
+import madss_results
+read_text_results = not os.path.isfile(madss_results.results_path(ADVERSE_EVENT))
+stored_results = madss_results.load_results(ADVERSE_EVENT, graph)
+
+def load_stored_Sj(METRIC, description):
+    if stored_results is not None:
+        Sj_from_results = madss_results.Sj_dict(stored_results, METRIC)
+        if Sj_from_results is not None:
+            print "\nLoading %s from results file" %description
+            print METRIC.upper(), "neighborhood size:",sum(1 for Sj in Sj_from_results.itervalues() if Sj > 0)
+            return Sj_from_results
+    if read_text_results and os.path.isfile('results/%s_Sj_%s.txt' %(METRIC, ADVERSE_EVENT)):
+        print "\nLoading %s from results file" %description
+        return read_Sj_file(METRIC)
+    return None
+
 # ------ Run connectivity functions ------
-# Mean first passage time (MFPT)
-if os.path.isfile('results/mfpt_Sj_%s.txt' %ADVERSE_EVENT) and 'mfpt' in metrics:
-    print "\nLoading mean first passage time from results file"
-    Sj_scores['mfpt'] = read_Sj_file('mfpt')
-elif 'mfpt' in metrics:
-    import madss_mfpt
-    print "\nRunning mean first passage time"
-    Sj_scores['mfpt'] = madss_mfpt.calc_mfpt_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds)
-
-# Betweenness centrality (BC)
-if os.path.isfile('results/bc_Sj_%s.txt' %ADVERSE_EVENT) and 'bc' in metrics:
-    print "\nLoading betweenness centrality from results file"
-    Sj_scores['bc'] = read_Sj_file('bc')
-elif 'bc' in metrics:
-    import madss_bc
-    print "\nRunning betweenness centrality"
-    Sj_scores['bc'] = madss_bc.calc_bc_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds)
-
-# Shared neighbors (SN)
-if os.path.isfile('results/sn_Sj_%s.txt' %ADVERSE_EVENT) and 'sn' in metrics:
-    print "\nLoading shared neighbors from results file"
-    Sj_scores['sn'] = read_Sj_file('sn')
-elif 'sn' in metrics:
-    import madss_sn
-    print "\nRunning shared neighbors"
-    Sj_scores['sn'] = madss_sn.calc_sn_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds)
-
-# Inverse shortest path (ISP)
-if os.path.isfile('results/isp_Sj_%s.txt' %ADVERSE_EVENT) and 'isp' in metrics:
-    print "\nLoading inverse shortest path from results file"
-    Sj_scores['isp'] = read_Sj_file('isp')
-elif 'isp' in metrics:
-    import madss_isp
-    print "\nRunning inverse shortest path"
-    Sj_scores['isp'] = madss_isp.calc_isp_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds)
+# Mean first passage time (MFPT), betweenness centrality (BC), shared neighbors (SN)
+# and inverse shortest path (ISP); the ones without stored results run concurrently
+import madss_scheduler
+for METRIC in metrics:
+    Sj_scores[METRIC] = load_stored_Sj(METRIC, madss_scheduler.METRIC_NAMES[METRIC])
+to_run = [METRIC for METRIC in metrics if Sj_scores[METRIC] is None]
+Sj_scores.update(madss_scheduler.calc_Sj_scores(graph, ADVERSE_EVENT, to_run, processes, concurrent))
+
+# Save all Sj vectors for this phenotype as one columnar results file
+madss_results.save_results(ADVERSE_EVENT, graph, Sj_scores, previous=stored_results)
+
+def write_run_report():
+    madss_telemetry.write_report('results/%s_run_report.json' %ADVERSE_EVENT, adverse_event=ADVERSE_EVENT,
+                                 metrics=metrics, num_seeds=len(seeds), num_nodes=graph.num_nodes)
 
 
 # ------ Assign each drug to most highly connected target ------
 if metrics != ['mfpt', 'bc', 'sn', 'isp']: # (i.e., if only seeking to calculate one function's scores)
+    write_run_report()
     sys.exit("Only calcualated connectivity for %s. Exiting." %metrics[0].upper())
 
 import madss_scoring
@@ -143,15 +170,20 @@ print "Scoring drugs"
 gt_drugs, id2gt = madss_scoring.open_gold_standard(ADVERSE_EVENT)
 
 # Collect drug targets from DrugBank
-drug_list, drugbank_targets, drugbank2name, ensembl2gene = madss_scoring.get_drugbank_targets(ADVERSE_EVENT, gt_drugs, node_list)
+with madss_telemetry.span('get_drugbank_targets'):
+    drug_list, drugbank_targets, drugbank2name, ensembl2gene = madss_scoring.get_drugbank_targets(ADVERSE_EVENT, gt_drugs, graph.index)
 
 # Score drugs
-madss_scoring.score_drugs(ADVERSE_EVENT, drug_list, drugbank_targets, drugbank2name, ensembl2gene, id2gt, Sj_scores)
+with madss_telemetry.span('score_drugs'):
+    madss_scoring.score_drugs(ADVERSE_EVENT, drug_list, drugbank_targets, drugbank2name, ensembl2gene, id2gt, Sj_scores)
 
 
 # ------ Train classifier and generate ROC plot ------
 import madss_classifier
 print '\n------------'
 print "Training classifier"
-madss_classifier.generate_ROC(ADVERSE_EVENT) #, plot_raw=True)
+with madss_telemetry.span('generate_ROC'):
+    madss_classifier.generate_ROC(ADVERSE_EVENT) #, plot_raw=True)
+
+write_run_report()
 
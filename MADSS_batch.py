@@ -0,0 +1,185 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Batch MADSS script. Runs several phenotypes in one process, loading the
+interactome and the seed-independent aggregates only once, for example:
+python MADSS_batch.py --phenotypes=MI,LQTS --processes=4
+python MADSS_batch.py my_seeds.tsv
+Seed files list one phenotype per line followed by its seed ENSP ids (see
+madss_libraries/madss_seeds.py). Without seed files or --phenotypes all
+phenotypes from the paper are run. Each phenotype writes its results, drug
+scores (when a gold standard exists) and ROC plot as MADSS.py does; its
+console output goes to results/<phenotype>_batch.log and its run report to
+results/<phenotype>_run_report.json. With --silent nothing is printed.
+
+"""
+
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+
+# Locate necessary MADSS libraries
+wd = os.getcwd()
+sys.path.insert(0, wd+'/madss_libraries/')
+
+import madss_credits
+import madss_interactome
+import madss_seeds
+import madss_engine
+import madss_results
+import madss_cache
+import madss_telemetry
+
+# Workers inherit the interactome and aggregates from the parent process on fork
+_pool_graph = None
+_pool_aggregates = None
+
+def run_phenotype(ADVERSE_EVENT, seeds, graph, aggregates):
+    start = time.time()
+    graph = graph.with_seeds(seeds)
+    print 'Number of seeds: ', len(seeds)
+
+    stored_results = madss_results.load_results(ADVERSE_EVENT, graph)
+    if stored_results is not None and stored_results['metadata']['metrics'] == madss_engine.METRICS:
+        print "Loading Sj from results file"
+        Sj_vectors = dict((METRIC, stored_results[METRIC]) for METRIC in madss_engine.METRICS)
+    else:
+        with madss_telemetry.span('score_seeds', adverse_event=ADVERSE_EVENT):
+            graph, Sj_vectors = madss_engine.score_seeds(graph, aggregates, seeds)
+
+    Sj_scores = dict()
+    for METRIC in madss_engine.METRICS:
+        Sj_scores[METRIC] = madss_results.write_Sj_file(METRIC, ADVERSE_EVENT, graph, Sj_vectors[METRIC])
+        print METRIC.upper(), "neighborhood size:", sum(1 for Sj in Sj_scores[METRIC].itervalues() if Sj > 0)
+    madss_results.save_results(ADVERSE_EVENT, graph, Sj_vectors)
+
+    if os.path.isfile('gold_standards/gold_standard_%s.csv' %ADVERSE_EVENT):
+        import madss_scoring
+        import madss_classifier
+        print "Scoring drugs"
+        gt_drugs, id2gt = madss_scoring.open_gold_standard(ADVERSE_EVENT)
+        drug_list, drugbank_targets, drugbank2name, ensembl2gene = madss_scoring.get_drugbank_targets(ADVERSE_EVENT, gt_drugs, graph.index)
+        with madss_telemetry.span('score_drugs', adverse_event=ADVERSE_EVENT):
+            madss_scoring.score_drugs(ADVERSE_EVENT, drug_list, drugbank_targets, drugbank2name, ensembl2gene, id2gt, Sj_scores)
+        print "Training classifier"
+        with madss_telemetry.span('generate_ROC', adverse_event=ADVERSE_EVENT):
+            madss_classifier.generate_ROC(ADVERSE_EVENT)
+    else:
+        print "No gold standard for %s, skipping drug scoring" %ADVERSE_EVENT
+
+    return time.time() - start
+
+# Runs one phenotype with its console output in results/<AE>_batch.log and
+# the telemetry recorded meanwhile in results/<AE>_run_report.json; returns
+# (phenotype, seconds, error)
+def _run_task(task):
+    ADVERSE_EVENT, seeds = task
+    since = madss_telemetry.mark()
+    stdout = sys.stdout
+    sys.stdout = open('results/%s_batch.log' %ADVERSE_EVENT, 'w')
+    try:
+        with madss_telemetry.span('phenotype', adverse_event=ADVERSE_EVENT):
+            return ADVERSE_EVENT, run_phenotype(ADVERSE_EVENT, seeds, _pool_graph, _pool_aggregates), None
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        return ADVERSE_EVENT, None, traceback.format_exc().strip().splitlines()[-1]
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        madss_telemetry.write_report('results/%s_run_report.json' %ADVERSE_EVENT, since,
+                                     adverse_event=ADVERSE_EVENT, num_seeds=len(seeds))
+
+def run_batch(seed_sets, processes=1):
+    global _pool_graph, _pool_aggregates
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if not os.path.exists('results'):
+        os.makedirs('results')
+
+    with madss_telemetry.span('load_network'):
+        _pool_graph = madss_interactome.load_network()
+    print "Loading seed-independent aggregates"
+    with madss_telemetry.span('load_aggregates'):
+        _pool_aggregates = madss_engine.load_aggregates(_pool_graph, processes)
+
+    tasks = seed_sets.items()
+    failed = []
+    print "Running %d phenotypes on %d processes" %(len(tasks), min(processes, len(tasks)))
+    if processes == 1:
+        finished = (_run_task(task) for task in tasks)
+    else:
+        # a fresh worker per phenotype keeps plotting state and memory from piling up
+        pool = multiprocessing.Pool(min(processes, len(tasks)), maxtasksperchild=1)
+        finished = pool.imap_unordered(_run_task, tasks)
+    try:
+        for ADVERSE_EVENT, seconds, error in finished:
+            if error is None:
+                print "%s done in %.1fs" %(ADVERSE_EVENT, seconds)
+            else:
+                print "%s failed: %s (see results/%s_batch.log)" %(ADVERSE_EVENT, error, ADVERSE_EVENT)
+                failed.append(ADVERSE_EVENT)
+            sys.stdout.flush()
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+        _pool_graph = None
+        _pool_aggregates = None
+
+    return failed
+
+
+if __name__ == '__main__':
+    if '--silent' in sys.argv:
+        madss_telemetry.set_silent(True)
+        sys.argv.remove('--silent')
+    madss_credits.print_intro()
+
+    processes = 1
+    phenotypes = []
+    seed_files = []
+    for arg in sys.argv[1:]:
+        if arg == '--import-legacy':
+            madss_cache.IMPORT_LEGACY = True
+        elif arg.startswith('--processes='):
+            processes = int(arg.split('=')[1]) or None
+        elif arg.startswith('--phenotypes='):
+            phenotypes = [p for p in arg.split('=')[1].split(',') if p]
+        else:
+            seed_files.append(arg)
+
+    if not phenotypes and not seed_files:
+        phenotypes = madss_seeds.PHENOTYPE_SEEDS.keys()
+
+    seed_sets = madss_seeds.OrderedDict()
+    for ADVERSE_EVENT in phenotypes:
+        if ADVERSE_EVENT not in madss_seeds.PHENOTYPE_SEEDS:
+            sys.exit('Error: no seeds defined for %s. Exiting.' %ADVERSE_EVENT)
+        seed_sets[ADVERSE_EVENT] = madss_seeds.PHENOTYPE_SEEDS[ADVERSE_EVENT]
+    for seed_file in seed_files:
+        seed_sets.update(madss_seeds.read_seed_file(seed_file))
+
+    start = time.time()
+    failed = run_batch(seed_sets, processes)
+    print "Batch finished in %.1fs" %(time.time() - start)
+    madss_telemetry.write_report('results/batch_run_report.json', phenotypes=seed_sets.keys(), failed=failed)
+    if failed:
+        sys.exit('Failed phenotypes: %s' %', '.join(failed))
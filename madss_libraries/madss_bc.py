@@ -20,15 +20,12 @@ Script to compute adapted betweenness centrality connectivity function.
 
 """
 
-import os
-import sys
 import numpy as np
-import networkx as nx
-import cPickle as pickle
-
-def restart_line():
-    sys.stdout.write('\r')
-    sys.stdout.flush()
+import multiprocessing
+import madss_interactome
+import madss_cache
+import madss_telemetry
+import madss_results
 
 #----------------------------------------------------------------------------------------
 '''Adapted from NetworkX betweenness_centrality function
@@ -70,128 +67,158 @@ THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-def sub_betweenness_centrality(G, subset):
+def sub_betweenness_centrality(graph, subset, processes=1):
     print "Calculating betweenness for subset of length", len(subset)
-    betweenness=dict.fromkeys(G,0.0) # b[v]=0 for v in G
+    if processes != 1 and len(subset) > 1:
+        return parallel_betweenness_centrality(graph, subset, processes)
+
+    betweenness=np.zeros(graph.num_nodes) # b[v]=0 for v in G
+    dist, sigma, delta = _kernel_buffers(graph)
     
     for i,node in enumerate(subset):
-        sys.stdout.write('%d: s=%s' %(i,node))
-        sys.stdout.flush()
-        restart_line()
-        # single source shortest paths
-        S,P,sigma=_single_source_shortest_path_basic(G,node)
-        # accumulation
-        betweenness=_accumulate_basic(betweenness,S,P,sigma,node)
+        madss_telemetry.progress('BC sources', i+1, len(subset))
+        # single source shortest paths and accumulation
+        _single_source_dependencies(graph,node,dist,sigma,delta)
+        betweenness+=delta
+    madss_telemetry.progress('BC sources', len(subset), len(subset), final=True)
 
     return betweenness
-    
-def _single_source_shortest_path_basic(G,s):
-    S=[]
-    P={}
-    for v in G:
-        P[v]=[]
-    sigma=dict.fromkeys(G,0.0)    # sigma[v]=0 for v in G
-    D={}
-    sigma[s]=1.0
-    D[s]=0
-    Q=[s]
-    while Q:   # use BFS to find shortest paths
-        v=Q.pop(0)
-        S.append(v)
-        Dv=D[v]
-        sigmav=sigma[v]
-        for w in G[v]:
-            if w not in D:
-                Q.append(w)
-                D[w]=Dv+1
-            if D[w]==Dv+1:   # this is a shortest path, count paths
-                sigma[w] += sigmav
-                P[w].append(v) # predecessors 
-    return S,P,sigma
-
-def _accumulate_basic(betweenness,S,P,sigma,s):
-    delta=dict.fromkeys(S,0)
-    while S:
-        w=S.pop()
-        coeff=(1.0+delta[w])/sigma[w]
-        for v in P[w]:
-            delta[v] += sigma[v]*coeff
-        if w != s:
-            betweenness[w]+=delta[w]
+
+# Contributions from different sources simply add, so sources are split into
+# chunks, each worker returns a partial betweenness array for its chunk, and
+# the partial arrays are summed. Workers inherit the graph from the parent
+# process on fork instead of receiving a pickled copy with every chunk.
+_pool_graph = None
+
+def _partial_betweenness(chunk):
+    betweenness=np.zeros(_pool_graph.num_nodes)
+    dist, sigma, delta = _kernel_buffers(_pool_graph)
+    for node in chunk:
+        _single_source_dependencies(_pool_graph,node,dist,sigma,delta)
+        betweenness+=delta
     return betweenness
 
+def parallel_betweenness_centrality(graph, subset, processes=None, chunks_per_process=4):
+    global _pool_graph
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(subset))
+    num_chunks = min(len(subset), processes*chunks_per_process)
+    chunks = [list(subset[k::num_chunks]) for k in xrange(num_chunks)]
+
+    _pool_graph = graph
+    pool = multiprocessing.Pool(processes)
+    done = 0
+    try:
+        betweenness = np.zeros(graph.num_nodes)
+        for partial in pool.imap_unordered(_partial_betweenness, chunks):
+            betweenness += partial
+            done += 1
+            madss_telemetry.progress('BC chunks', done, num_chunks)
+    finally:
+        madss_telemetry.progress('BC chunks', done, num_chunks, final=True)
+        pool.close()
+        pool.join()
+        _pool_graph = None
+
+    return betweenness
+
+# Distance, path count and dependency buffers, allocated once and reused for
+# every source
+def _kernel_buffers(graph):
+    return (np.empty(graph.num_nodes, dtype=np.int32),
+            np.empty(graph.num_nodes),
+            np.empty(graph.num_nodes))
+
+# Level-synchronous BFS from s over the CSR arrays followed by dependency
+# accumulation. Each BFS level is expanded with array operations, and the
+# predecessor relation is kept as flat (v, w) edge arrays per level rather
+# than a list per node. On return delta[v] is the dependency of s on v, with
+# delta[s] = 0.
+def _single_source_dependencies(graph,s,dist,sigma,delta):
+    numNodes = graph.num_nodes
+
+    dist.fill(-1)
+    sigma.fill(0.0)
+    delta.fill(0.0)
+    dist[s]=0
+    sigma[s]=1.0
+
+    levels=[]
+    frontier=np.array([s], dtype=np.int32)
+    Dv=0
+    while len(frontier):   # use BFS to find shortest paths
+        src,dst=madss_interactome.frontier_edges(graph,frontier)
+        new=dst[dist[dst]<0]
+        dist[new]=Dv+1
+        on_path=dist[dst]==Dv+1   # this is a shortest path, count paths
+        src=src[on_path]
+        dst=dst[on_path]
+        sigma+=np.bincount(dst,weights=sigma[src],minlength=numNodes)
+        levels.append((src,dst))   # predecessors
+
+        frontier=np.unique(new)
+        Dv+=1
+
+    # accumulation, deepest level first
+    for src,dst in reversed(levels):
+        delta+=np.bincount(src,weights=sigma[src]/sigma[dst]*(1.0+delta[dst]),minlength=numNodes)
+    delta[s]=0.0
+    return delta
+
+# Dependency of each source on every node, one row per source; a seed set's
+# centralities are the sum of the rows of its seeds
+def dependency_rows(graph, sources):
+    rows = np.empty((len(sources), graph.num_nodes))
+    dist, sigma, delta = _kernel_buffers(graph)
+    for k, s in enumerate(sources):
+        rows[k] = _single_source_dependencies(graph, s, dist, sigma, delta)
+    return rows
+
 #----------------------------------------------------------------------------------------
 
-def calc_bc_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds):
-    seeds_left = []
-    for node in node_list:
-        for seed in seeds:
-            if node == seed:
-                if not node in seeds_left:
-                    seeds_left.append(node)
-    # print "Number of seeds left:",len(seeds_left)
-
-    complement = []
-    for node in node_list:
-        if not node in seeds_left:
-            if not node in complement:
-                complement.append(node)
+def load_centralities(graph, processes=1):
+    return madss_cache.cached(graph, 'centralities_no_rescale', 1,
+                              lambda: sub_betweenness_centrality(graph, range(graph.num_nodes), processes),
+                              legacy=lambda: madss_cache.legacy_pickle(graph, "stored_vals/centralities_no_rescale.p"))
+
+# Sj for all nodes at once from the all-node and seed centralities. For many
+# seed sets at once, seed_centralities and seed_mask are N x P (one column per
+# seed set) and so is the result.
+def calc_Sj_stored(centralities, seed_centralities, seed_mask):
+    numNodes = len(centralities)
+    numSeeds = np.count_nonzero(seed_mask, axis=0)
+    numComplement = numNodes - numSeeds
+    if np.ndim(seed_centralities) == 2:
+        centralities = centralities[:,np.newaxis]
+
+    # Comp centralities are merely all_centralities - seed_centralities
+    comp_centralities = centralities - seed_centralities
+
+    # Nodes with zero centrality get Sj = 0
+    nonzero = centralities != 0
+    node_in_seeds = seed_mask.astype(float)
+    node_in_comp = 1.0 - node_in_seeds
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = centralities/( (numNodes-1) * (numNodes-2) )
+        inSeed = seed_centralities/( (numSeeds-node_in_seeds) * (numNodes-2) )
+        compVal = comp_centralities/( (numComplement-node_in_comp) * (numNodes-2) )
+        Sj_vector = np.where(nonzero, (inSeed - compVal) / denominator, 0.0)
+    return Sj_vector
+
+def calc_bc_Sj(graph, ADVERSE_EVENT, processes=1):
     # Calculate betweenness centralities
-    seed_centralities = sub_betweenness_centrality(H, seeds_left)
+    seed_centralities = sub_betweenness_centrality(graph, graph.seed_ids().tolist(), processes)
     print "seed centralities calculated"
 
-    try:
-        centralities =  pickle.load(open("stored_vals/centralities_no_rescale.p", "rb") )
-    except:
-        centralities = sub_betweenness_centrality(H, node_list)
-        if not os.path.exists('stored_vals'):
-            os.makedirs('stored_vals')
-        pickle.dump(centralities, open("stored_vals/centralities_no_rescale.p", "wb"))
+    centralities = load_centralities(graph, processes)
     print "all centralities loaded"
 
-    # Comp centralities are merely all_centralities - seed_centralities
-    comp_centralities = dict()
-    for node in H:
-        comp_centralities[node] = centralities[node] - seed_centralities[node]
-    print "comp centralities calculated"
-
-    Sj_file = open('results/bc_Sj_%s.txt' %(ADVERSE_EVENT), 'w')
-
-    Sj_dict = dict()
-    neighborhood = []
-    for node in H:
-        if centralities[node] != 0:
-            denominator = centralities[node]/( (len(node_list)-1) * (len(node_list)-2) )
-            
-            if node in seeds_left:
-                node_in_seeds = 1
-                node_in_comp = 0
-            elif node in complement:
-                node_in_seeds = 0
-                node_in_comp = 1
-            
-            inSeed = seed_centralities[node]/( (len(seeds_left)-node_in_seeds) * (len(node_list)-2) )
-            
-            compVal = comp_centralities[node]/( (len(complement)-node_in_comp) * (len(node_list)-2) )
-            
-            Sj = (inSeed - compVal) / denominator
-            
-        else:
-            inSeed = 0
-            compVal = 0
-            denominator = 0
-            Sj = 0
-            
-        Sj_dict[node]= Sj
-        Sj_file.write("%s\t%s\n" % (str(Sj),node))
-        
-        if Sj > 0:
-            if not node in neighborhood:
-                neighborhood.append(node)
-
-    print "Neighborhood size:",len(neighborhood)
-
-    Sj_file.close()
+    Sj_vector = calc_Sj_stored(centralities, seed_centralities, graph.seed_mask)
+
+    Sj_dict = madss_results.write_Sj_file('bc', ADVERSE_EVENT, graph, Sj_vector)
+
+    print "Neighborhood size:",np.count_nonzero(Sj_vector > 0)
 
     return Sj_dict
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Benchmarks every stage of the MADSS pipeline on reproducible synthetic data.
+For each network size and density a Barabasi-Albert scale-free interactome
+is generated together with a random seed set, a gold standard and synthetic
+drug targets (drugs that cause the phenotype are biased towards targets near
+the seeds). The pipeline then runs in a fresh working directory with a cold
+cache, stage by stage: load_network (edge list conversion, then the binary
+load), each calc_*_Sj, score_drugs and generate_ROC. Each stage's wall time,
+CPU time and peak resident memory are recorded. Peak memory is read from
+/proc/self/status after resetting the high-water mark through
+/proc/self/clear_refs, or from getrusage where that is not available (it then
+never decreases between stages). Each case runs in its own forked process;
+a case whose process dies (e.g. killed for running out of memory) or runs
+past --timeout is recorded as failed, with the stage it was in, and the
+benchmark moves on. The report is rewritten after every case.
+Run from the MADSS folder, for example:
+python madss_libraries/madss_benchmark.py --sizes=1000,5000,20000 --densities=2,5 --output=results/benchmark.json
+With --processes=N the precomputations use a pool, and memory used by its
+workers is not included in the peak figures.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import random
+import platform
+import tempfile
+import traceback
+import Queue
+import multiprocessing
+import cPickle as pickle
+import numpy as np
+import scipy
+import networkx as nx
+import madss_telemetry
+
+ADVERSE_EVENT = 'BENCH'
+STAGE_METRICS = ['mfpt', 'bc', 'sn', 'isp']
+
+#----------------------------------------------------------------------------------------
+# Synthetic data
+
+# Writes string700_data.p, the gold standard and the pickled DrugBank
+# targets for a scale-free network of num_nodes proteins, each new protein
+# attaching to density existing ones. Returns the case description.
+def write_synthetic_data(num_nodes, density, num_seeds=30, num_drugs=200, max_targets=5, random_state=0):
+    rng = random.Random(random_state)
+    H = nx.barabasi_albert_graph(num_nodes, density, seed=random_state)
+    names = ['ENSP%011d' %i for i in xrange(num_nodes)]
+    pickle.dump([(names[a], names[b]) for a, b in H.edges()], open('string700_data.p', 'wb'), pickle.HIGHEST_PROTOCOL)
+
+    seeds = rng.sample(xrange(num_nodes), num_seeds)
+    near_seeds = sorted(set(seeds) | set(neighbor for seed in seeds for neighbor in H.neighbors(seed)))
+
+    if not os.path.exists('gold_standards'):
+        os.makedirs('gold_standards')
+    gold_standard = open('gold_standards/gold_standard_%s.csv' %ADVERSE_EVENT, 'w')
+    gold_standard.write('drug,drugbank_id,gt\n')
+    drugbank_targets = dict()
+    drugbank2name = dict()
+    for k in xrange(num_drugs):
+        drugbank_id = 'DB%05d' %k
+        causes_AE = k % 3 == 0
+        targets = set()
+        for t in xrange(rng.randint(1, max_targets)):
+            if causes_AE and rng.random() < 0.5:
+                targets.add(names[rng.choice(near_seeds)])
+            else:
+                targets.add(names[rng.randrange(num_nodes)])
+        drugbank_targets[drugbank_id] = targets
+        drugbank2name[drugbank_id] = 'drug %d' %k
+        gold_standard.write('drug %d,%s,%d\n' %(k, drugbank_id, causes_AE))
+    gold_standard.close()
+
+    if not os.path.exists('stored_vals'):
+        os.makedirs('stored_vals')
+    pickle.dump(drugbank_targets, open('stored_vals/drugbank_targets_%s.p' %ADVERSE_EVENT, 'wb'))
+    pickle.dump(drugbank2name, open('stored_vals/drugbank2name_%s.p' %ADVERSE_EVENT, 'wb'))
+    pickle.dump(dict((name, 'GENE%d' %i) for i, name in enumerate(names)), open('stored_vals/ensembl2gene_%s.p' %ADVERSE_EVENT, 'wb'))
+
+    return {'nodes': num_nodes, 'density': density, 'edges': H.number_of_edges(),
+            'seeds': [names[i] for i in seeds], 'drugs': num_drugs, 'random_state': random_state}
+
+#----------------------------------------------------------------------------------------
+# Stage measurements
+
+# Runs stage() and appends its measurements to stages; returns its result.
+# on_stage, if given, is called with the stage name before it runs and with
+# the finished measurements.
+def measure(stages, name, stage, on_stage=None):
+    if on_stage is not None:
+        on_stage('running', name)
+    peak_reset = madss_telemetry.reset_peak_rss()
+    start_times = os.times()
+    start = time.time()
+    result = stage()
+    wall = time.time() - start
+    end_times = os.times()
+    stages.append({'stage': name,
+                   'wall_s': round(wall, 4),
+                   'cpu_s': round((end_times[0] + end_times[1]) - (start_times[0] + start_times[1]), 4),
+                   'peak_rss_mb': round(madss_telemetry.peak_rss_mb(), 1),
+                   'peak_rss_reset': peak_reset})
+    print "%s: %.2fs" %(name, wall)
+    if on_stage is not None:
+        on_stage('stage', stages[-1])
+    return result
+
+# The MADSS.py pipeline on the synthetic data in the current directory
+def run_pipeline(case, metrics, processes=1, on_stage=None):
+    import madss_interactome
+    import madss_scheduler
+    import madss_scoring
+    import madss_classifier
+
+    stages = []
+    measure(stages, 'load_network', madss_interactome.load_network, on_stage)
+    graph = measure(stages, 'load_network_binary', madss_interactome.load_network, on_stage)
+    graph = graph.with_seeds(case['seeds'])
+    if not os.path.exists('results'):
+        os.makedirs('results')
+
+    Sj_scores = dict()
+    for METRIC in metrics:
+        Sj_scores[METRIC] = measure(stages, 'calc_%s_Sj' %METRIC,
+                                    lambda: madss_scheduler.calc_Sj(METRIC, graph, ADVERSE_EVENT, processes), on_stage)
+
+    if metrics == STAGE_METRICS:
+        gt_drugs, id2gt = madss_scoring.open_gold_standard(ADVERSE_EVENT)
+        drug_list, drugbank_targets, drugbank2name, ensembl2gene = madss_scoring.get_drugbank_targets(ADVERSE_EVENT, gt_drugs, graph.index)
+        measure(stages, 'score_drugs',
+                lambda: madss_scoring.score_drugs(ADVERSE_EVENT, drug_list, drugbank_targets, drugbank2name, ensembl2gene, id2gt, Sj_scores),
+                on_stage)
+        measure(stages, 'generate_ROC', lambda: madss_classifier.generate_ROC(ADVERSE_EVENT), on_stage)
+    return stages
+
+#----------------------------------------------------------------------------------------
+# Each case runs in its own forked process and working directory, so the
+# cache starts cold and memory figures are not inflated by earlier cases.
+# Console output of a case goes to benchmark.log in its directory. The case
+# process reports each stage as it starts and finishes, so a case that dies
+# (e.g. killed for memory) or runs past the timeout is still recorded with
+# the stages it completed and the one it was in.
+
+def _case_process(num_nodes, density, options, workdir, results):
+    stdout = sys.stdout
+    os.chdir(workdir)
+    sys.stdout = open('benchmark.log', 'w')
+    case = {'nodes': num_nodes, 'density': density}
+    try:
+        case = write_synthetic_data(num_nodes, density, options['seeds'], options['drugs'],
+                                    random_state=options['random_state'])
+        case['stages'] = run_pipeline(case, options['metrics'], options['processes'],
+                                      lambda kind, value: results.put((kind, value)))
+        case['status'] = 'ok'
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        case['status'] = 'error: %s' %traceback.format_exc().strip().splitlines()[-1]
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    case.pop('seeds', None)
+    results.put(('done', case))
+
+def run_case(num_nodes, density, options):
+    workdir = tempfile.mkdtemp(prefix='madss_benchmark_')
+    results = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=_case_process, args=(num_nodes, density, options, workdir, results))
+    start = time.time()
+    worker.start()
+
+    case = None
+    stages = []
+    running = None
+    try:
+        while case is None:
+            try:
+                kind, value = results.get(timeout=1)
+            except Queue.Empty:
+                if not worker.is_alive() and results.empty():
+                    status = 'process exited with code %s' %worker.exitcode
+                elif options['timeout'] and time.time() - start > options['timeout']:
+                    worker.terminate()
+                    status = 'timed out after %ds' %options['timeout']
+                else:
+                    continue
+                case = {'nodes': num_nodes, 'density': density, 'stages': stages,
+                        'status': 'error: %s%s' %(status, ' in %s' %running if running else '')}
+                continue
+            if kind == 'running':
+                running = value
+            elif kind == 'stage':
+                stages.append(value)
+                running = None
+            else:
+                case = value
+    finally:
+        # case is still None if waiting was interrupted; the original error
+        # propagates once the worker is stopped
+        if case is None and worker.is_alive():
+            worker.terminate()
+        worker.join()
+        if not options['keep']:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif case is not None:
+            case['workdir'] = workdir
+    return case
+
+def host_info():
+    info = {'hostname': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'networkx': nx.__version__,
+            'cpu_count': multiprocessing.cpu_count()}
+    try:
+        for line in open('/proc/meminfo'):
+            if line.startswith('MemTotal:'):
+                info['memory_mb'] = int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    return info
+
+# With output given, the report is rewritten after every case
+def run_benchmarks(sizes, densities, metrics=STAGE_METRICS, num_seeds=30, num_drugs=200, processes=1, random_state=0,
+                   keep=False, timeout=None, output=None):
+    options = {'metrics': metrics, 'seeds': num_seeds, 'drugs': num_drugs, 'processes': processes,
+               'random_state': random_state, 'keep': keep, 'timeout': timeout}
+    report = {'created': time.time(), 'host': host_info(), 'options': options, 'cases': []}
+    for num_nodes in sizes:
+        for density in densities:
+            print "Benchmarking %d nodes, density %d..." %(num_nodes, density),
+            sys.stdout.flush()
+            case = run_case(num_nodes, density, options)
+            report['cases'].append(case)
+            if case['status'] == 'ok':
+                print '%.1fs' %sum(stage['wall_s'] for stage in case['stages'])
+            else:
+                print case['status']
+            if output is not None:
+                write_report(report, output)
+    return report
+
+def write_report(report, output):
+    if not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    tmp_path = '%s.%d.tmp' %(output, os.getpid())
+    f = open(tmp_path, 'w')
+    json.dump(report, f, indent=1, sort_keys=True)
+    f.close()
+    os.rename(tmp_path, output)
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    if [arg for arg in sys.argv[1:] if not arg.startswith('--')]:
+        sys.exit('Usage: python madss_libraries/madss_benchmark.py [--sizes=1000,5000,10000] [--densities=2,5] '
+                 '[--metrics=mfpt,bc,sn,isp] [--seeds=30] [--drugs=200] [--processes=1] [--random-seed=0] '
+                 '[--timeout=seconds] [--output=results/benchmark.json] [--keep]')
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    # cases run in their own directories, so the libraries are found by absolute path
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    output = os.path.abspath(options.get('output', 'results/benchmark.json'))
+
+    report = run_benchmarks([int(size) for size in options.get('sizes', '1000,5000,10000').split(',')],
+                            [int(density) for density in options.get('densities', '2,5').split(',')],
+                            [METRIC for METRIC in options.get('metrics', ','.join(STAGE_METRICS)).split(',')],
+                            int(options.get('seeds', 30)), int(options.get('drugs', 200)),
+                            int(options.get('processes', 1)) or None, int(options.get('random-seed', 0)),
+                            '--keep' in sys.argv, float(options.get('timeout', 0)) or None, output)
+    write_report(report, output)
+    print "Benchmark report written to %s" %output
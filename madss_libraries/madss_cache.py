@@ -0,0 +1,242 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Content-addressed cache for the seed-independent precomputations kept in
+/stored_vals (all-node centralities, Tc and ISP sums, MFPT column data).
+Entries are keyed by a fingerprint of the processed interactome together
+with the name and version of the algorithm that produced them, so swapping
+the interactome or changing an algorithm never reuses stale values. Writes
+go to a temporary file that is renamed into place, each entry is built
+under an exclusive file lock so concurrent runs wait for one another
+rather than racing, and a manifest tracks entry sizes and last use for
+size-based eviction.
+The unversioned files in /stored_vals carry no fingerprint, so a network
+with the same proteins but different edges cannot be told apart from the
+one they were computed for. They are therefore only imported on request
+(--import-legacy, or MADSS_IMPORT_LEGACY=1); otherwise the values are
+rebuilt.
+
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import numpy as np
+import cPickle as pickle
+from contextlib import contextmanager
+import madss_telemetry
+
+CACHE_DIR = 'stored_vals/cache'
+MAX_CACHE_BYTES = 20 * 1024**3
+IMPORT_LEGACY = os.environ.get('MADSS_IMPORT_LEGACY', '') not in ('', '0')
+
+@contextmanager
+def _locked(path, blocking=True):
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        # only raised for a non-blocking lock that is already held
+        lock_file.close()
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+def _atomic_write(path, write):
+    tmp_path = '%s.%d.tmp' %(path, os.getpid())
+    f = open(tmp_path, 'wb')
+    try:
+        write(f)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+#----------------------------------------------------------------------------------------
+
+# sha1 over the protein id table and the CSR arrays of the processed graph
+def graph_fingerprint(graph):
+    if getattr(graph, '_fingerprint', None) is None:
+        h = hashlib.sha1()
+        h.update('\n'.join(graph.names))
+        h.update(graph.indptr.tostring())
+        h.update(graph.indices.tostring())
+        graph._fingerprint = h.hexdigest()
+    return graph._fingerprint
+
+def cache_key(graph, name, version):
+    return '%s-v%s-%s' %(name, version, graph_fingerprint(graph)[:20])
+
+def _entry_path(key, value=None):
+    for ext in ('.npy', '.p'):
+        path = os.path.join(CACHE_DIR, key + ext)
+        if value is None and os.path.isfile(path):
+            return path
+    if value is None:
+        return None
+    return os.path.join(CACHE_DIR, key + ('.npy' if isinstance(value, np.ndarray) else '.p'))
+
+#----------------------------------------------------------------------------------------
+# Manifest: {key: {'name', 'version', 'fingerprint', 'file', 'bytes', 'created', 'last_used'}}
+
+def _manifest_path():
+    return os.path.join(CACHE_DIR, 'manifest.json')
+
+def read_manifest():
+    try:
+        return json.load(open(_manifest_path(), 'r'))
+    except (IOError, ValueError):
+        return dict()
+
+def _update_manifest(update):
+    with _locked(os.path.join(CACHE_DIR, 'manifest.lock')):
+        manifest = read_manifest()
+        update(manifest)
+        _atomic_write(_manifest_path(), lambda f: json.dump(manifest, f, indent=1, sort_keys=True))
+
+def _touch(key):
+    def update(manifest):
+        if key in manifest:
+            manifest[key]['last_used'] = time.time()
+    _update_manifest(update)
+
+# Removes least recently used entries until the cache fits in max_bytes.
+# Entries that are being built by another run (their lock is held) are
+# skipped rather than waited on, since that run may itself be waiting for
+# the manifest.
+def evict(max_bytes=None, keep=()):
+    if max_bytes is None:
+        max_bytes = MAX_CACHE_BYTES
+    def update(manifest):
+        total = sum(entry['bytes'] for entry in manifest.values())
+        for key in sorted(manifest, key=lambda k: manifest[k]['last_used']):
+            if total <= max_bytes:
+                break
+            if key in keep:
+                continue
+            with _locked(os.path.join(CACHE_DIR, key + '.lock'), blocking=False) as acquired:
+                if not acquired:
+                    continue
+                path = os.path.join(CACHE_DIR, manifest[key]['file'])
+                if os.path.isfile(path):
+                    os.remove(path)
+            total -= manifest[key]['bytes']
+            print "Evicted %s from cache" %key
+            del manifest[key]
+    _update_manifest(update)
+
+#----------------------------------------------------------------------------------------
+
+def _load(key, mmap_mode=None):
+    path = _entry_path(key)
+    if path is None:
+        return None
+    if path.endswith('.npy'):
+        value = np.load(path, mmap_mode=mmap_mode)
+    else:
+        value = pickle.load(open(path, 'rb'))
+    _touch(key)
+    return value
+
+def load(graph, name, version, mmap_mode=None):
+    key = cache_key(graph, name, version)
+    value = _load(key, mmap_mode)
+    madss_telemetry.event('cache', name=name, key=key, result='miss' if value is None else 'hit')
+    return value
+
+def store(graph, name, version, value):
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    key = cache_key(graph, name, version)
+    path = _entry_path(key, value)
+    if isinstance(value, np.ndarray):
+        _atomic_write(path, lambda f: np.save(f, value))
+    else:
+        _atomic_write(path, lambda f: pickle.dump(value, f, pickle.HIGHEST_PROTOCOL))
+
+    def update(manifest):
+        now = time.time()
+        manifest[key] = {'name': name, 'version': version, 'fingerprint': graph_fingerprint(graph),
+                         'file': os.path.basename(path), 'bytes': os.path.getsize(path),
+                         'created': now, 'last_used': now}
+    _update_manifest(update)
+    evict(keep=(key,))
+
+# Returns the cached value for (graph, name, version), building it with
+# compute() on a miss. The entry is built under an exclusive lock, so a
+# concurrent run asking for the same entry waits and then reads the result.
+# legacy() may return a value from an unversioned /stored_vals file to seed
+# the cache with, or None.
+def cached(graph, name, version, compute, legacy=None, mmap_mode=None):
+    key = cache_key(graph, name, version)
+    value = _load(key, mmap_mode)
+    if value is not None:
+        madss_telemetry.event('cache', name=name, key=key, result='hit')
+        return value
+
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    with _locked(os.path.join(CACHE_DIR, key + '.lock')):
+        value = _load(key, mmap_mode)
+        if value is not None:
+            # built by a concurrent run while this one waited for the lock
+            madss_telemetry.event('cache', name=name, key=key, result='hit')
+            return value
+        if legacy is not None:
+            value = legacy()
+        if value is not None:
+            madss_telemetry.event('cache', name=name, key=key, result='legacy')
+        else:
+            madss_telemetry.event('cache', name=name, key=key, result='miss')
+            with madss_telemetry.span('build %s' %name):
+                value = compute()
+        store(graph, name, version, value)
+        if mmap_mode is not None and isinstance(value, np.ndarray):
+            value = _load(key, mmap_mode)
+    return value
+
+# Whether an unversioned /stored_vals file at path may be imported
+def legacy_allowed(path):
+    if not os.path.isfile(path):
+        return False
+    if not IMPORT_LEGACY:
+        print "Not importing %s, which may be stale for this interactome (use --import-legacy if it is current)" %path
+        return False
+    return True
+
+# Reads a pre-cache /stored_vals pickle of {protein_id: value} as an array in
+# graph order, when importing is enabled and its protein ids match the
+# interactome's exactly
+def legacy_pickle(graph, path):
+    if not legacy_allowed(path):
+        return None
+    try:
+        stored = pickle.load(open(path, 'rb'))
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+    if len(stored) != graph.num_nodes or not all(node in stored for node in graph.names):
+        print "Ignoring %s: its proteins do not match the interactome" %path
+        return None
+    print "Importing %s into the cache" %path
+    return np.array([stored[node] for node in graph.names])
@@ -19,6 +19,12 @@ http://creativecommons.org/licenses/by-nc-sa/4.0/
 Script to train random forest classifier using connectivity scores as
 features. Exports classifier probabilities and generates ROC plot.
 
+evaluate() estimates how stable the AUROCs are, for any number of phenotypes
+at once. It uses repeated stratified cross-validation and bootstrap resamples
+with out-of-bag evaluation, spread over a worker pool. Run from the MADSS
+folder after the drug scores have been generated, for example:
+python madss_libraries/madss_classifier.py MI Liver --cv-repeats=50 --bootstraps=500 --processes=0
+
 """
 
 import os
@@ -26,12 +32,19 @@ import sys
 import csv
 import numpy as np
 import scipy as sp
+import multiprocessing
 import matplotlib.pyplot as plt
 from sklearn import metrics
 from sklearn import ensemble
+from sklearn.model_selection import StratifiedKFold
 from collections import defaultdict
+import madss_telemetry
 
-def generate_ROC(ADVERSE_EVENT, plot_raw=False):
+all_metrics = ['mfpt', 'bc', 'sn', 'isp']
+
+# Drugs in the scores file with their names, connectivity scores (one column
+# per metric, as features) and gold standard labels
+def load_drug_scores(ADVERSE_EVENT):
     f = open('scores/%s_drug_scores.csv' %(ADVERSE_EVENT),'rU')
     reader = csv.reader(f)
     reader.next()
@@ -39,8 +52,6 @@ def generate_ROC(ADVERSE_EVENT, plot_raw=False):
     drug_list = []
     drugbank2name = dict()
 
-    drug2score = defaultdict(dict)
-
     data_sets = []
     for drug_name,drugbank_id,training,mfpt,mfpt_target,bc,bc_target,sn,sn_target,isp,isp_target in reader:
         to_map = [training,mfpt,bc,sn,isp]
@@ -48,22 +59,21 @@ def generate_ROC(ADVERSE_EVENT, plot_raw=False):
         
         drug_list.append(drugbank_id)
         drugbank2name[drugbank_id] = drug_name
-        
-        drug2score['mfpt'][drugbank_id] = float(mfpt)
-        drug2score['bc'][drugbank_id] = float(bc)
-        drug2score['sn'][drugbank_id] = float(sn)
-        drug2score['isp'][drugbank_id] = float(isp)
     f.close()
 
     examples = np.array([row[1:] for row in data_sets])
     labels = np.array([row[0] for row in data_sets])
+    return drug_list, drugbank2name, examples, labels
 
+# Random forest classifier
+def classifier(oob_score=False, random_state=None):
+    return ensemble.RandomForestClassifier(n_estimators=100, max_features=1, max_depth=None, oob_score=oob_score, random_state=random_state)
 
-    # Initialize random forest classifier
-    clf_init = lambda: ensemble.RandomForestClassifier(n_estimators=100, max_features=1, max_depth=None, oob_score=True)
+def generate_ROC(ADVERSE_EVENT, plot_raw=False):
+    drug_list, drugbank2name, examples, labels = load_drug_scores(ADVERSE_EVENT)
 
     # Random Forest
-    clf = clf_init()
+    clf = classifier(oob_score=True)
     clf.fit(examples, labels)
 
     rf_auroc = metrics.roc_auc_score(labels, clf.oob_decision_function_[:,1])
@@ -90,15 +100,8 @@ def generate_ROC(ADVERSE_EVENT, plot_raw=False):
     roc_curves = dict()
     aurocs = dict()
 
-    all_metrics = ['mfpt', 'bc', 'sn', 'isp']
-
-    scores = defaultdict(list)
-    for drug in drug_list:
-        for metric in all_metrics:
-            scores[metric].append(drug2score[metric][drug])
-
-    for metric in all_metrics:
-        fpr, tpr, thresholds = metrics.roc_curve(labels, scores[metric])
+    for k, metric in enumerate(all_metrics):
+        fpr, tpr, thresholds = metrics.roc_curve(labels, examples[:,k])
         roc_curves[metric] = [fpr, tpr]
         aurocs[metric] = metrics.auc(fpr, tpr)
         #print metric,aurocs[metric]
@@ -158,3 +161,120 @@ def generate_ROC(ADVERSE_EVENT, plot_raw=False):
     if plot_raw == True:
         filename += '+raw'
     plt.savefig('figs/%s.pdf' %filename)
+
+
+# ------ Repeated cross-validation and bootstrap evaluation ------
+# Workers inherit the examples and labels of each phenotype from the parent
+# process on fork
+_pool_scores = None
+
+# One evaluation round: a repeat of stratified k-fold cross-validation
+# (AUROCs averaged over the held-out folds) or one bootstrap resample
+# (forest trained on the resample, all AUROCs on the drugs left out of it).
+# Returns (phenotype, method, {'rf' or metric: AUROC})
+def _evaluation_round(task):
+    ADVERSE_EVENT, method, seed, folds = task
+    examples, labels = _pool_scores[ADVERSE_EVENT]
+
+    if method == 'cv':
+        splits = StratifiedKFold(folds, shuffle=True, random_state=seed).split(examples, labels)
+    else:
+        sample = np.random.RandomState(seed).randint(0, len(labels), len(labels))
+        splits = [(sample, np.setdiff1d(np.arange(len(labels)), sample))]
+
+    # A round whose training or held-out drugs are all of one class has no
+    # AUROC and returns no values
+    aurocs = defaultdict(list)
+    for train, test in splits:
+        if len(np.unique(labels[train])) < 2 or len(np.unique(labels[test])) < 2:
+            continue
+        clf = classifier(random_state=seed)
+        clf.fit(examples[train], labels[train])
+        aurocs['rf'].append(metrics.roc_auc_score(labels[test], clf.predict_proba(examples[test])[:,1]))
+        for k, metric in enumerate(all_metrics):
+            aurocs[metric].append(metrics.roc_auc_score(labels[test], examples[test,k]))
+
+    return ADVERSE_EVENT, method, dict((model, np.mean(values)) for model, values in aurocs.iteritems())
+
+# Mean AUROC and percentile confidence interval of the forest and of each raw
+# connectivity score, per phenotype and evaluation method. Returns
+# {(phenotype, method, model): (mean, ci_low, ci_high, rounds)} and writes
+# them to probabilities/classifier_evaluation.csv
+def evaluate(ADVERSE_EVENTS, cv_repeats=20, folds=5, bootstraps=200, processes=1, confidence=0.95, seed=0):
+    global _pool_scores
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    _pool_scores = dict()
+    tasks = []
+    for ADVERSE_EVENT in ADVERSE_EVENTS:
+        drug_list, drugbank2name, examples, labels = load_drug_scores(ADVERSE_EVENT)
+        _pool_scores[ADVERSE_EVENT] = (examples, labels)
+        ae_folds = int(min(folds, np.bincount(labels.astype(int), minlength=2).min()))
+        if ae_folds < 2:
+            print "Skipping cross-validation for %s: it needs at least 2 drugs in each class" %ADVERSE_EVENT
+        else:
+            tasks += [(ADVERSE_EVENT, 'cv', seed+i, ae_folds) for i in xrange(cv_repeats)]
+        tasks += [(ADVERSE_EVENT, 'bootstrap', seed+i, None) for i in xrange(bootstraps)]
+
+    rounds = defaultdict(list)
+    skipped = defaultdict(int)
+    if processes == 1:
+        finished = (_evaluation_round(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        finished = pool.imap_unordered(_evaluation_round, tasks, chunksize=max(1, len(tasks)/(processes*8)))
+    done = 0
+    try:
+        for ADVERSE_EVENT, method, aurocs in finished:
+            if not aurocs:
+                skipped[(ADVERSE_EVENT, method)] += 1
+            for model, auroc in aurocs.iteritems():
+                rounds[(ADVERSE_EVENT, method, model)].append(auroc)
+            done += 1
+            madss_telemetry.progress('Evaluation rounds', done, len(tasks))
+    finally:
+        madss_telemetry.progress('Evaluation rounds', done, len(tasks), final=True)
+        if processes != 1:
+            pool.close()
+            pool.join()
+        _pool_scores = None
+
+    for (ADVERSE_EVENT, method), count in sorted(skipped.iteritems()):
+        print "Skipped %d %s rounds for %s whose training or held-out drugs were all of one class" %(count, method, ADVERSE_EVENT)
+
+    tail = (1 - confidence) / 2 * 100
+    summary = dict()
+    for key, values in rounds.iteritems():
+        summary[key] = (np.mean(values), np.percentile(values, tail), np.percentile(values, 100 - tail), len(values))
+
+    if not os.path.exists('probabilities'):
+        os.makedirs('probabilities')
+    outf = open('probabilities/classifier_evaluation.csv', 'w')
+    writer = csv.writer(outf)
+    writer.writerow(['phenotype', 'method', 'model', 'mean_auroc', 'ci_low', 'ci_high', 'rounds'])
+    print "%-8s %-10s %-5s %8s   %d%% CI" %('AE', 'method', 'model', 'AUROC', confidence*100)
+    for ADVERSE_EVENT in ADVERSE_EVENTS:
+        for method in ['cv', 'bootstrap']:
+            for model in ['rf'] + all_metrics:
+                if (ADVERSE_EVENT, method, model) not in summary:
+                    continue
+                mean, low, high, num_rounds = summary[(ADVERSE_EVENT, method, model)]
+                writer.writerow([ADVERSE_EVENT, method, model, mean, low, high, num_rounds])
+                print "%-8s %-10s %-5s %8.3f   %.3f-%.3f" %(ADVERSE_EVENT, method, model.upper(), mean, low, high)
+    outf.close()
+    print "Evaluation written to probabilities/classifier_evaluation.csv"
+
+    return summary
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    ADVERSE_EVENTS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not ADVERSE_EVENTS:
+        sys.exit('Usage: python madss_libraries/madss_classifier.py MI [Liver ...] [--cv-repeats=20] [--folds=5] [--bootstraps=200] [--processes=1]')
+    evaluate(ADVERSE_EVENTS,
+             cv_repeats=int(options.get('cv-repeats', 20)),
+             folds=int(options.get('folds', 5)),
+             bootstraps=int(options.get('bootstraps', 200)),
+             processes=int(options.get('processes', 1)) or None)
@@ -0,0 +1,232 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Seed editing and leave-one-seed-out analysis from per-seed contributions.
+Each connectivity function depends on a seed set only through the sum of
+one contribution row per seed (the seed's MFPT row, Brandes dependencies,
+Tc row and 1/d row). The four rows of every seed are persisted in the cache
+(see madss_cache.py), keyed by interactome and protein. A seed state holds
+the rows of the current seeds and their running sums, so adding or removing
+a seed updates every Sj vector with O(N) arithmetic, and leaving out each
+seed in turn costs about as much as one normal run. Run from the MADSS
+folder, for example:
+python madss_libraries/madss_contributions.py MI --add=ENSP00000206249 --remove=ENSP00000366307 --leave-one-out
+writes the Sj results and drug scores for the edited seed set under the
+name <AE>_edited (or --name=...), so the files MADSS.py wrote for the
+phenotype's own seed set are left alone. It also writes the edited seed set
+to results/<AE>_edited_seeds.tsv (which can be passed back with
+--seed-file) and the leave-one-out report to results/<AE>_leave_one_out.csv.
+
+"""
+
+import os
+import sys
+import csv
+import numpy as np
+from scipy.stats import spearmanr
+import madss_interactome
+import madss_cache
+import madss_engine
+import madss_results
+import madss_scoring
+import madss_seeds
+
+METRICS = madss_engine.METRICS
+CONTRIBUTIONS_VERSION = 1
+
+def _entry_name(protein):
+    return 'seed_contributions_%s' %protein
+
+# {node id: 4 x N contribution rows in METRICS order}, loaded from the cache
+# or computed (and cached) for the seeds that have none yet
+def load_seed_rows(graph, aggregates, seed_ids, processes=1):
+    rows = dict()
+    missing = []
+    for i in seed_ids:
+        value = madss_cache.load(graph, _entry_name(graph.names[i]), CONTRIBUTIONS_VERSION)
+        if value is None:
+            missing.append(i)
+        else:
+            rows[i] = value
+    if missing:
+        print "Computing contributions of %d seeds" %len(missing)
+        computed = [madss_engine.contribution_matrix(METRIC, graph, missing, processes, aggregates['mfpt'])
+                    for METRIC in METRICS]
+        for k, i in enumerate(missing):
+            rows[i] = np.array([metric_rows[k] for metric_rows in computed])
+            madss_cache.store(graph, _entry_name(graph.names[i]), CONTRIBUTIONS_VERSION, rows[i])
+    return rows
+
+#----------------------------------------------------------------------------------------
+# Seed state: {'graph': seeded graph context, 'aggregates': see
+# madss_engine.load_aggregates, 'rows': {seed id: 4 x N rows}, 'sums': 4 x N}
+
+def seed_state(graph, aggregates, seeds, processes=1):
+    graph = graph.with_seeds(seeds)
+    rows = load_seed_rows(graph, aggregates, graph.seed_ids(), processes)
+    sums = np.zeros((len(METRICS), graph.num_nodes))
+    for i in graph.seed_ids():
+        sums += rows[i]
+    return {'graph': graph, 'aggregates': aggregates, 'rows': rows, 'sums': sums}
+
+# Both return whether the seed set changed
+def add_seed(state, protein, processes=1):
+    graph = state['graph']
+    if protein not in graph.index:
+        print "%s is not in the interactome" %protein
+        return False
+    i = graph.index[protein]
+    if graph.seed_mask[i]:
+        return False
+    state['rows'].update(load_seed_rows(graph, state['aggregates'], [i], processes))
+    state['sums'] += state['rows'][i]
+    graph.seed_mask[i] = True
+    graph.comp_mask[i] = False
+    return True
+
+def remove_seed(state, protein):
+    graph = state['graph']
+    i = graph.index.get(protein)
+    if i is None or not graph.seed_mask[i]:
+        return False
+    state['sums'] -= state['rows'].pop(i)
+    graph.seed_mask[i] = False
+    graph.comp_mask[i] = True
+    return True
+
+# {metric: Sj vector in graph order} for the current seeds
+def state_Sj(state, metrics=METRICS):
+    Sj_vectors = dict()
+    for k, METRIC in enumerate(METRICS):
+        if METRIC in metrics:
+            Sj_vectors[METRIC] = madss_engine.Sj_from_seed_sums(METRIC, state['aggregates'], state['sums'][k],
+                                                                state['graph'].seed_mask)[:,0]
+    return Sj_vectors
+
+# Seed ids and {metric: N x k Sj matrix} with column k scoring the seed set
+# without its k-th seed
+def leave_one_out(state, metrics=METRICS):
+    graph = state['graph']
+    seed_ids = graph.seed_ids()
+    seed_matrix = np.repeat(graph.seed_mask[:,np.newaxis], len(seed_ids), axis=1)
+    seed_matrix[seed_ids, np.arange(len(seed_ids))] = False
+
+    Sj_matrices = dict()
+    for k, METRIC in enumerate(METRICS):
+        if METRIC in metrics:
+            left_out = np.array([state['rows'][i][k] for i in seed_ids]).T
+            Sj_matrices[METRIC] = madss_engine.Sj_from_seed_sums(METRIC, state['aggregates'],
+                                                                 state['sums'][k][:,np.newaxis] - left_out, seed_matrix)
+    return seed_ids, Sj_matrices
+
+#----------------------------------------------------------------------------------------
+
+# results/<AE>_leave_one_out.csv: for each seed and connectivity function,
+# the neighborhood (Sj > 0) without the seed and how it differs from the full
+# seed set's, the correlation of the Sj vectors, and, given the drug x protein
+# incidence matrix (see madss_scoring.drug_target_matrix), the Spearman
+# correlation of the drug scores and their largest change
+def write_leave_one_out_report(ADVERSE_EVENT, state, incidence=None, ensembl2gene=None):
+    graph = state['graph']
+    Sj_vectors = state_Sj(state)
+    seed_ids, Sj_matrices = leave_one_out(state)
+    if ensembl2gene is None:
+        ensembl2gene = dict()
+
+    outf = open('results/%s_leave_one_out.csv' %ADVERSE_EVENT, 'w')
+    writer = csv.writer(outf)
+    writer.writerow(['left_out_seed', 'gene', 'metric', 'neighborhood_size', 'neighborhood_lost', 'neighborhood_gained',
+                     'Sj_correlation', 'drug_score_spearman', 'max_drug_score_change'])
+    for METRIC in METRICS:
+        full = Sj_vectors[METRIC]
+        in_neighborhood = full > 0
+        if incidence is not None:
+            full_scores = madss_scoring.best_targets(incidence, full)[0][:,0]
+            drug_scores = madss_scoring.best_targets(incidence, Sj_matrices[METRIC])[0]
+            has_targets = ~np.isnan(full_scores)
+        for k, i in enumerate(seed_ids):
+            Sj_vector = Sj_matrices[METRIC][:,k]
+            row = [graph.names[i], ensembl2gene.get(graph.names[i], ''), METRIC,
+                   np.count_nonzero(Sj_vector > 0),
+                   np.count_nonzero(in_neighborhood & ~(Sj_vector > 0)),
+                   np.count_nonzero(~in_neighborhood & (Sj_vector > 0)),
+                   np.corrcoef(full, Sj_vector)[0,1]]
+            if incidence is not None:
+                row += [spearmanr(full_scores[has_targets], drug_scores[has_targets,k])[0],
+                        np.abs(drug_scores[has_targets,k] - full_scores[has_targets]).max()]
+            writer.writerow(row)
+    outf.close()
+    print "Leave-one-out report for %d seeds written to results/%s_leave_one_out.csv" %(len(seed_ids), ADVERSE_EVENT)
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    phenotypes = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(phenotypes) != 1:
+        sys.exit('Usage: python madss_libraries/madss_contributions.py MI [--seed-file=seeds.tsv] '
+                 '[--add=ENSP...,ENSP...] [--remove=ENSP...,ENSP...] [--name=MI_edited] [--leave-one-out] [--processes=1]')
+    ADVERSE_EVENT = phenotypes[0]
+    # Results for the edited seed set never replace those of the phenotype
+    name = options.get('name', ADVERSE_EVENT + '_edited')
+    if name == ADVERSE_EVENT:
+        sys.exit('Error: --name must differ from %s, whose results MADSS.py writes. Exiting.' %ADVERSE_EVENT)
+    if 'seed-file' in options:
+        seed_sets = madss_seeds.read_seed_file(options['seed-file'])
+    else:
+        seed_sets = madss_seeds.PHENOTYPE_SEEDS
+    if ADVERSE_EVENT not in seed_sets:
+        sys.exit('Error: no seeds defined for %s. Exiting.' %ADVERSE_EVENT)
+
+    processes = int(options.get('processes', 1)) or None
+    graph = madss_interactome.load_network()
+    aggregates = madss_engine.load_aggregates(graph, processes)
+    state = seed_state(graph, aggregates, seed_sets[ADVERSE_EVENT], processes)
+
+    edited = False
+    for protein in [protein for protein in options.get('add', '').split(',') if protein]:
+        if add_seed(state, protein, processes):
+            print "Added seed %s" %protein
+            edited = True
+    for protein in [protein for protein in options.get('remove', '').split(',') if protein]:
+        if remove_seed(state, protein):
+            print "Removed seed %s" %protein
+            edited = True
+    graph = state['graph']
+    print 'Number of seeds: ', np.count_nonzero(graph.seed_mask)
+
+    if not os.path.exists('results'):
+        os.makedirs('results')
+    if edited:
+        seeds_file = open('results/%s_seeds.tsv' %name, 'w')
+        seeds_file.write('\t'.join([ADVERSE_EVENT] + [graph.names[i] for i in graph.seed_ids()]) + '\n')
+        seeds_file.close()
+
+    # Sj results and drug scores for the (edited) seed set, in the layout of MADSS.py
+    Sj_scores = dict()
+    for METRIC, Sj_vector in state_Sj(state).iteritems():
+        Sj_scores[METRIC] = madss_results.write_Sj_file(METRIC, name, graph, Sj_vector)
+        print METRIC.upper(), "neighborhood size:",np.count_nonzero(Sj_vector > 0)
+    madss_results.save_results(name, graph, Sj_scores)
+
+    gt_drugs, id2gt = madss_scoring.open_gold_standard(ADVERSE_EVENT)
+    drug_list, drugbank_targets, drugbank2name, ensembl2gene = madss_scoring.get_drugbank_targets(ADVERSE_EVENT, gt_drugs, graph.index)
+    madss_scoring.score_drugs(name, drug_list, drugbank_targets, drugbank2name, ensembl2gene, id2gt, Sj_scores)
+
+    if '--leave-one-out' in sys.argv:
+        incidence = madss_scoring.drug_target_matrix(drug_list, drugbank_targets, graph.index)
+        write_leave_one_out_report(ADVERSE_EVENT, state, incidence, ensembl2gene)
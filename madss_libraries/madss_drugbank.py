@@ -0,0 +1,310 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+DrugBank target lookup for madss_scoring. Drug names and the network
+proteins each drug acts on (targets, enzymes and transporters) are fetched
+in batches of parameterized IN queries, one query for the names and one for
+the partners of each batch.
+
+Targets are read from a local SQLite copy of the tables used, stored at
+stored_vals/drugbank.sqlite, if it exists; otherwise from the MySQL DrugBank
+3 (compound_drugbank03) and UniProt id mapping (protein_uniprot) databases
+configured in ~/.my.cnf. The local file can be copied from MySQL with
+python madss_libraries/madss_drugbank.py --mirror [stored_vals/drugbank.sqlite]
+or built without MySQL from a DrugBank XML release (version 3 or later,
+optionally zipped or gzipped) and a UniProt id mapping file such as
+HUMAN_9606_idmapping.dat.gz with
+python madss_libraries/madss_drugbank.py --ingest drugbank.xml idmapping.dat [stored_vals/drugbank.sqlite]
+Both files are streamed, so memory use does not grow with the release size.
+
+"""
+
+import os
+import sys
+import gzip
+import sqlite3
+import zipfile
+from collections import defaultdict
+import xml.etree.cElementTree as ET
+import madss_telemetry
+
+DRUGBANK_SQLITE = 'stored_vals/drugbank.sqlite'
+
+# Drug-partner tables and the column holding the partner id
+PARTNER_TABLES = [('drug_allTargets_human', 'Target_Partner'),
+                  ('drug_allEnzymes_human', 'Enzyme_Partner'),
+                  ('drug_allTransporters_human', 'Transporter_Partner')]
+
+# Columns of each table used by MADSS, as kept in the SQLite copy
+SCHEMA = [('drug_categories', ['drugbank_id TEXT', 'drugname TEXT']),
+          ('drug_allTargets_human', ['drugbank_id TEXT', 'Target_Partner INTEGER']),
+          ('drug_allEnzymes_human', ['drugbank_id TEXT', 'Enzyme_Partner INTEGER']),
+          ('drug_allTransporters_human', ['drugbank_id TEXT', 'Transporter_Partner INTEGER']),
+          ('partner_protein', ['Partner_ID INTEGER', 'UniProt_ID TEXT', 'Gene_Name TEXT']),
+          ('idmapping', ['uniprot TEXT', 'id_type TEXT', 'id TEXT'])]
+
+INDEXES = [('drug_categories', 'drugbank_id'),
+           ('drug_allTargets_human', 'drugbank_id'),
+           ('drug_allEnzymes_human', 'drugbank_id'),
+           ('drug_allTransporters_human', 'drugbank_id'),
+           ('partner_protein', 'Partner_ID'),
+           ('idmapping', 'uniprot, id_type')]
+
+def create_schema(connection):
+    for table, columns in SCHEMA:
+        connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' %(table, ', '.join(columns)))
+
+def create_indexes(connection):
+    for table, columns in INDEXES:
+        connection.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' %(table, columns.split(',')[0], table, columns))
+
+def _mysql_connection():
+    import MySQLdb
+    return MySQLdb.connect(read_default_file='~/.my.cnf', db = 'compound_drugbank03')
+
+# Returns (connection, parameter placeholder, {table: name to query it by})
+def connect(path=None):
+    if path is None and os.path.isfile(DRUGBANK_SQLITE):
+        path = DRUGBANK_SQLITE
+    if path is not None:
+        connection = sqlite3.connect(path)
+        # plain strings, as returned by MySQLdb
+        connection.text_factory = str
+        return connection, '?', dict((table, table) for table, columns in SCHEMA)
+
+    tables = dict((table, 'compound_drugbank03.%s' %table) for table, columns in SCHEMA)
+    tables['idmapping'] = 'protein_uniprot.idmapping'
+    return _mysql_connection(), '%s', tables
+
+def _partner_query(tables, placeholders):
+    return ' UNION '.join('''SELECT DISTINCT drugs.drugbank_id, idmapping.id, partner_protein.Gene_Name
+                             FROM %s drugs, %s partner_protein, %s idmapping
+                             WHERE idmapping.id_type = 'Ensembl_PRO'
+                             AND idmapping.uniprot = partner_protein.UniProt_ID
+                             AND partner_protein.Partner_ID = drugs.%s
+                             AND drugs.drugbank_id IN (%s)''' %(tables[table], tables['partner_protein'], tables['idmapping'], column, placeholders)
+                          for table, column in PARTNER_TABLES)
+
+# Drugs from drug_ids that are in DrugBank (ordered by name) with their names,
+# network targets and target gene names
+def get_targets(drug_ids, node_index, path=None, batch_size=300):
+    connection, placeholder, tables = connect(path)
+    cursor = connection.cursor()
+
+    drug_ids = sorted(set(drug_ids))
+    drugbank_targets = dict()
+    drugbank2name = dict()
+    ensembl2gene = dict()
+    for start in xrange(0, len(drug_ids), batch_size):
+        batch = drug_ids[start:start+batch_size]
+        placeholders = ','.join([placeholder]*len(batch))
+
+        cursor.execute('SELECT DISTINCT drugbank_id, drugname FROM %s WHERE drugbank_id IN (%s)' %(tables['drug_categories'], placeholders), batch)
+        for drugbank_id, drugname in cursor.fetchall():
+            drugbank_targets.setdefault(drugbank_id, set())
+            drugbank2name[drugbank_id] = drugname
+
+        cursor.execute(_partner_query(tables, placeholders), batch*len(PARTNER_TABLES))
+        for drugbank_id, target, name in cursor.fetchall():
+            if drugbank_id in drugbank_targets and target in node_index:
+                drugbank_targets[drugbank_id].add(target)
+                ensembl2gene[target] = name
+
+    cursor.close()
+    connection.close()
+
+    drug_list = sorted(drugbank_targets, key=lambda drugbank_id: (drugbank2name[drugbank_id].lower(), drugbank_id))
+    return drug_list, drugbank_targets, drugbank2name, ensembl2gene
+
+# Copies the tables used by MADSS from MySQL into a local SQLite file
+def create_mirror(path=DRUGBANK_SQLITE, chunk_size=10000):
+    import MySQLdb.cursors
+    mysql_connection = _mysql_connection()
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    create_schema(connection)
+
+    for table, columns in SCHEMA:
+        names = [column.split()[0] for column in columns]
+        source = 'protein_uniprot.idmapping' if table == 'idmapping' else 'compound_drugbank03.%s' %table
+        SQL = 'SELECT DISTINCT %s FROM %s' %(', '.join(names), source)
+        if table == 'idmapping':
+            SQL += " WHERE id_type = 'Ensembl_PRO'"
+        cursor = mysql_connection.cursor(MySQLdb.cursors.SSCursor)
+        cursor.execute(SQL)
+        num_rows = 0
+        rows = cursor.fetchmany(chunk_size)
+        while rows:
+            connection.executemany('INSERT INTO %s VALUES (%s)' %(table, ','.join('?'*len(names))), rows)
+            num_rows += len(rows)
+            rows = cursor.fetchmany(chunk_size)
+        cursor.close()
+        print "%s: %d rows" %(table, num_rows)
+
+    create_indexes(connection)
+    connection.commit()
+    connection.close()
+    mysql_connection.close()
+
+# ------ DrugBank XML ingest ------
+# Drug-partner tables and the XML elements listing each kind of partner
+PARTNER_ELEMENTS = [('drug_allTargets_human', 'targets', 'target'),
+                    ('drug_allEnzymes_human', 'enzymes', 'enzyme'),
+                    ('drug_allTransporters_human', 'transporters', 'transporter')]
+
+def _open_stream(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zip'):
+        archive = zipfile.ZipFile(path)
+        return archive.open(archive.namelist()[0])
+    return open(path, 'rb')
+
+# Yields (root, record) for each drug, and each partner of DrugBank 3, once it
+# has been parsed. The record is cleared and dropped from its parent
+# afterwards, so only one record is held in memory at a time.
+def _iter_records(stream):
+    path = []
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem)
+            continue
+        path.pop()
+        if len(path) == 1 or (len(path) == 2 and path[1].tag.endswith('partners')):
+            yield path[0], elem
+            elem.clear()
+            path[-1].clear()
+
+def _uniprot_id(partner, ns):
+    for identifier in partner.findall('%sexternal-identifiers/%sexternal-identifier' %(ns, ns)):
+        if identifier.findtext(ns+'resource') in ('UniProtKB', 'UniProt Accession'):
+            return identifier.findtext(ns+'identifier')
+    return None
+
+# Reads drugs, drug-partner edges and human partner proteins from a DrugBank
+# XML release into the SQLite tables. DrugBank 3 lists partners after the
+# drugs and refers to them by id; later releases embed each partner's
+# polypeptides in the drug. Returns the UniProt ids of the human partners.
+def ingest_drugbank_xml(connection, xml_path, chunk_size=10000):
+    polypeptide_ids = dict() # UniProt id -> Partner_ID, for DrugBank 4 and later
+    uniprot_ids = set()
+    rows = defaultdict(list)
+    num_drugs = 0
+
+    def flush(final=False):
+        for table, table_rows in rows.iteritems():
+            if table_rows and (final or len(table_rows) >= chunk_size):
+                connection.executemany('INSERT INTO %s VALUES (%s)' %(table, ','.join('?'*len(table_rows[0]))), table_rows)
+                del table_rows[:]
+
+    stream = _open_stream(xml_path)
+    for root, record in _iter_records(stream):
+        ns = root.tag[:root.tag.index('}')+1] if root.tag.startswith('{') else ''
+        tag = record.tag[len(ns):]
+
+        if tag == 'drug':
+            drugbank_ids = record.findall(ns+'drugbank-id')
+            primary_ids = [elem.text for elem in drugbank_ids if elem.get('primary') == 'true']
+            drugbank_id = (primary_ids or [drugbank_ids[0].text])[0].strip()
+            rows['drug_categories'].append((drugbank_id, record.findtext(ns+'name')))
+            num_drugs += 1
+
+            for table, group, element in PARTNER_ELEMENTS:
+                for partner in record.findall('%s%s/%s%s' %(ns, group, ns, element)):
+                    if partner.get('partner') is not None:
+                        rows[table].append((drugbank_id, int(partner.get('partner'))))
+                        continue
+                    for polypeptide in partner.findall(ns+'polypeptide'):
+                        organism = polypeptide.find(ns+'organism')
+                        if organism is None or organism.get('ncbi-taxonomy-id') != '9606':
+                            continue
+                        uniprot = polypeptide.get('id')
+                        if uniprot not in polypeptide_ids:
+                            polypeptide_ids[uniprot] = len(polypeptide_ids) + 1
+                            rows['partner_protein'].append((polypeptide_ids[uniprot], uniprot, polypeptide.findtext(ns+'gene-name')))
+                            uniprot_ids.add(uniprot)
+                        rows[table].append((drugbank_id, polypeptide_ids[uniprot]))
+
+            madss_telemetry.progress('Drugs read', num_drugs)
+
+        elif tag == 'partner':
+            species = record.findtext('%sspecies/%sname' %(ns, ns)) or ''
+            uniprot = _uniprot_id(record, ns)
+            if uniprot is not None and species.strip() == 'Homo sapiens':
+                rows['partner_protein'].append((int(record.get('id')), uniprot, record.findtext(ns+'gene-name')))
+                uniprot_ids.add(uniprot)
+        flush()
+    madss_telemetry.progress('Drugs read', num_drugs, final=True)
+    flush(final=True)
+    stream.close()
+
+    print "%d drugs and %d human partner proteins read from %s" %(num_drugs, len(uniprot_ids), xml_path)
+    return uniprot_ids
+
+# Reads the Ensembl protein ids of the given UniProt accessions from a UniProt
+# id mapping file (accession, id type and id per tab-separated line). Isoform
+# accessions are mapped to their canonical accession and Ensembl id versions
+# are dropped, as in the STRING interactome.
+def ingest_idmapping(connection, idmapping_path, uniprot_ids):
+    ensembl_ids = defaultdict(set)
+    stream = _open_stream(idmapping_path)
+    for line in stream:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 3 or fields[1] != 'Ensembl_PRO':
+            continue
+        uniprot = fields[0].split('-')[0]
+        if uniprot in uniprot_ids:
+            ensembl_ids[uniprot].add(fields[2].split('.')[0])
+    stream.close()
+
+    connection.executemany('INSERT INTO idmapping VALUES (?,?,?)',
+                           ((uniprot, 'Ensembl_PRO', ensembl_id) for uniprot in sorted(ensembl_ids) for ensembl_id in sorted(ensembl_ids[uniprot])))
+    print "%d Ensembl proteins mapped to %d of the partner proteins" %(sum(len(ids) for ids in ensembl_ids.itervalues()), len(ensembl_ids))
+
+# Builds the local SQLite target database from a DrugBank XML release and a
+# UniProt id mapping file. The file is written under a temporary name and
+# moved into place once complete.
+def create_from_xml(xml_path, idmapping_path, path=DRUGBANK_SQLITE):
+    temp_path = '%s.%d.tmp' %(path, os.getpid())
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    connection.text_factory = str
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    create_schema(connection)
+
+    uniprot_ids = ingest_drugbank_xml(connection, xml_path)
+    ingest_idmapping(connection, idmapping_path, uniprot_ids)
+
+    create_indexes(connection)
+    connection.commit()
+    connection.close()
+    os.rename(temp_path, path)
+    print "DrugBank targets written to %s" %path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == '--mirror':
+        create_mirror(*sys.argv[2:3])
+    elif len(sys.argv) >= 4 and sys.argv[1] == '--ingest':
+        create_from_xml(*sys.argv[2:5])
+    else:
+        sys.exit('Usage: python madss_libraries/madss_drugbank.py --mirror [stored_vals/drugbank.sqlite]\n'
+                 '       python madss_libraries/madss_drugbank.py --ingest drugbank.xml idmapping.dat [stored_vals/drugbank.sqlite]')
@@ -0,0 +1,170 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Scores seed sets against seed-independent aggregates held in memory: the
+MFPT column data, all-node betweenness centralities, Tc sums and ISP sums.
+The aggregates are loaded (or built and cached) once with load_aggregates;
+after that, score_seeds only does the per-seed work for each connectivity
+function.
+
+"""
+
+import os
+import sys
+import multiprocessing
+import numpy as np
+import madss_mfpt
+import madss_bc
+import madss_sn
+import madss_isp
+
+METRICS = ['mfpt', 'bc', 'sn', 'isp']
+
+def load_aggregates(graph, processes=1):
+    aggregates = dict()
+    aggregates['mfpt'] = madss_mfpt.load_column_data(graph)
+    aggregates['bc'] = madss_bc.load_centralities(graph, processes)
+    aggregates['sn'] = madss_sn.load_Tc_alls(graph)
+    aggregates['isp'] = madss_isp.load_isp_alls(graph, processes)
+    return aggregates
+
+# Returns the seeded graph context and {metric: Sj vector in graph order}
+def score_seeds(graph, aggregates, seeds, metrics=METRICS):
+    graph = graph.with_seeds(seeds)
+    seeds_left = graph.seed_ids()
+    numSeeds = len(seeds_left)
+    numComplement = graph.num_nodes - numSeeds
+
+    Sj_vectors = dict()
+    if 'mfpt' in metrics:
+        Sj_vectors['mfpt'] = madss_mfpt.mfpt_Sj_matrix(graph, graph.seed_mask, column_data=aggregates['mfpt'])[:,0]
+    if 'bc' in metrics:
+        seed_centralities = madss_bc.sub_betweenness_centrality(graph, seeds_left.tolist())
+        Sj_vectors['bc'] = madss_bc.calc_Sj_stored(aggregates['bc'], seed_centralities, graph.seed_mask)
+    if 'sn' in metrics:
+        Tc_seeds = madss_sn.calc_Tc_seeds(graph, seeds_left)
+        Sj_vectors['sn'] = madss_sn.calc_Sj_stored(Tc_seeds, aggregates['sn'], numSeeds, numComplement)
+    if 'isp' in metrics:
+        isp_seeds = madss_isp.calc_isp_seeds(graph, seeds_left)
+        Sj_vectors['isp'] = madss_isp.calc_Sj_stored(isp_seeds, aggregates['isp'], numSeeds, numComplement)
+    return graph, Sj_vectors
+
+#----------------------------------------------------------------------------------------
+# Many seed sets at once. Every Sj formula depends on a seed set only through
+# sums of per-seed contributions (BC dependencies, Tc and 1/d rows; MFPT rows
+# are summed by the block solve in madss_mfpt), so the contribution row of
+# each seed that occurs in any set is computed once and the seed sums of all
+# sets follow from one matrix product.
+
+# Per-seed contribution rows of a connectivity function, one row per source.
+# MFPT rows need the column data of the sparse engine (see load_aggregates).
+def contribution_rows(METRIC, graph, sources, column_data=None):
+    if METRIC == 'mfpt':
+        if column_data is None:
+            column_data = madss_mfpt.load_column_data(graph)
+        return madss_mfpt.mfpt_rows(column_data, sources)
+    elif METRIC == 'bc':
+        return madss_bc.dependency_rows(graph, sources)
+    elif METRIC == 'sn':
+        return madss_sn.calc_Tc_rows(graph, sources)
+    elif METRIC == 'isp':
+        return madss_isp.isp_rows(graph, sources)
+    raise ValueError('no per-seed contribution rows for %s' %METRIC)
+
+# Workers inherit the graph from the parent process on fork
+_pool_graph = None
+
+def _contribution_chunk(task):
+    METRIC, chunk = task
+    return chunk, contribution_rows(METRIC, _pool_graph, chunk)
+
+# Yields (chunk of sources, contribution rows of the chunk) as they finish
+def _contribution_chunks(METRIC, graph, sources, processes=1, chunk_size=128):
+    global _pool_graph
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    tasks = [(METRIC, sources[start:start+chunk_size]) for start in xrange(0, len(sources), chunk_size)]
+
+    _pool_graph = graph
+    pool = None
+    if processes == 1 or len(tasks) < 2:
+        finished = (_contribution_chunk(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        finished = pool.imap_unordered(_contribution_chunk, tasks)
+    try:
+        for chunk, rows in finished:
+            yield chunk, rows
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _pool_graph = None
+
+# N x P sums of the contribution rows over the seeds of each column of seed_matrix
+def seed_contribution_sums(METRIC, graph, seed_matrix, processes=1, chunk_size=128):
+    S = np.asarray(seed_matrix, dtype=float).reshape(graph.num_nodes, -1)
+    candidates = np.flatnonzero(S.any(1))
+    seed_sums = np.zeros(S.shape)
+    for chunk, rows in _contribution_chunks(METRIC, graph, candidates, processes, chunk_size):
+        seed_sums += rows.T.dot(S[chunk])
+    return seed_sums
+
+# Dense k x N contribution rows for the given sources, in their order. MFPT
+# rows come from one block solve, the others from a pool as above.
+def contribution_matrix(METRIC, graph, sources, processes=1, column_data=None, chunk_size=128):
+    sources = np.asarray(sources, dtype=np.int64)
+    if METRIC == 'mfpt':
+        return contribution_rows(METRIC, graph, sources, column_data)
+    position = dict((source, k) for k, source in enumerate(sources.tolist()))
+    rows = np.zeros((len(sources), graph.num_nodes))
+    for chunk, chunk_rows in _contribution_chunks(METRIC, graph, sources, processes, chunk_size):
+        chunk_rows = chunk_rows.toarray() if hasattr(chunk_rows, 'toarray') else chunk_rows
+        rows[[position[source] for source in chunk.tolist()]] = chunk_rows
+    return rows
+
+# N x P Sj matrix of a connectivity function from the N x P sums of its
+# contribution rows over the seed sets in the columns of seed_matrix
+def Sj_from_seed_sums(METRIC, aggregates, seed_sums, seed_matrix):
+    seed_matrix = np.asarray(seed_matrix, dtype=bool).reshape(len(seed_sums), -1)
+    seed_sums = np.asarray(seed_sums, dtype=float).reshape(seed_matrix.shape)
+    numSeeds = seed_matrix.sum(0)
+    numComplement = len(seed_sums) - numSeeds
+    if METRIC == 'mfpt':
+        return madss_mfpt.calc_Sj_stored(madss_mfpt.sparse_column_sums(aggregates['mfpt']), seed_sums, numSeeds)
+    elif METRIC == 'bc':
+        return madss_bc.calc_Sj_stored(aggregates['bc'], seed_sums, seed_matrix)
+    elif METRIC == 'sn':
+        return madss_sn.calc_Sj_stored(seed_sums, aggregates['sn'][:,np.newaxis], numSeeds, numComplement)
+    elif METRIC == 'isp':
+        return madss_isp.calc_Sj_stored(seed_sums, aggregates['isp'][:,np.newaxis], numSeeds, numComplement)
+    raise ValueError('unknown connectivity function %s' %METRIC)
+
+# {metric: N x P Sj matrix} for the seed sets in the columns of seed_matrix
+# (see madss_interactome.seed_indicator_matrix)
+def score_seed_matrix(graph, aggregates, seed_matrix, metrics=METRICS, processes=1):
+    seed_matrix = np.asarray(seed_matrix, dtype=bool).reshape(graph.num_nodes, -1)
+
+    Sj_matrices = dict()
+    if 'mfpt' in metrics:
+        Sj_matrices['mfpt'] = madss_mfpt.mfpt_Sj_matrix(graph, seed_matrix, column_data=aggregates['mfpt'])
+    for METRIC in ['bc', 'sn', 'isp']:
+        if METRIC in metrics:
+            seed_sums = seed_contribution_sums(METRIC, graph, seed_matrix, processes)
+            Sj_matrices[METRIC] = Sj_from_seed_sums(METRIC, aggregates, seed_sums, seed_matrix)
+    return Sj_matrices
@@ -18,22 +18,192 @@ http://creativecommons.org/licenses/by-nc-sa/4.0/
 ------------------------------------------------------------------------
 Loads interactome (human protein-protein interaction network, PPIN) from
 STRING v9.1 above a confidence threshold of 700 (out of 1000), either as
-a pickled file or from a MySQL database. Processes network using NetworkX
-to find the largest connected island and returns this graph (H).
+a compact binary file, a pickled file or from a MySQL database. Finds the
+largest connected island and returns it as a GraphContext, an
+integer-indexed CSR view of the graph shared by all connectivity functions.
+
+The binary interactome format (.npz, see convert_edge_list) holds a sorted,
+interned table of protein ids, the edges as an int32 array of ids into that
+table, and a boolean mask of the proteins in the largest connected island.
+A pickled edge list is converted to this format the first time it is
+loaded. The binary file records the size, modification time and SHA-1 of the
+pickle it was converted from, and is converted again when the pickle
+changes. To convert by hand, e.g. from the command line:
+python madss_libraries/madss_interactome.py string700_data.p string700_data.npz
 
 """
 
 import os
 import sys
+import copy
+import hashlib
 import numpy as np
 # import MySQLdb
-import networkx as nx
 import cPickle as pickle
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+INTERACTOME_FORMAT = 'MADSS-interactome'
+INTERACTOME_VERSION = 1
+
+class GraphContext(object):
+    # Node ids follow the sorted protein ids (the same order as the rows and
+    # columns of stored_vals/mfptMatrix.npy). Neighbors of node i are
+    # indices[indptr[i]:indptr[i+1]].
+    def __init__(self, names, indptr, indices):
+        self.names = names
+        self.index = dict((name, i) for i, name in enumerate(names))
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.num_nodes = len(names)
+        self.degree = np.diff(self.indptr)
+        self.num_edges = len(self.indices) // 2
+        self.seed_mask = None
+        self.comp_mask = None
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def adjacency(self, dtype=np.float64):
+        data = np.ones(len(self.indices), dtype=dtype)
+        return sparse.csr_matrix((data, self.indices, self.indptr), shape=(self.num_nodes, self.num_nodes))
+
+    # Returns a context sharing this graph's arrays with seed and complement
+    # masks set for the given seeds (seeds outside the interactome are dropped)
+    def with_seeds(self, seeds):
+        seeded = copy.copy(self)
+        seeded.seed_mask = np.zeros(self.num_nodes, dtype=bool)
+        seeded.seed_mask[[self.index[seed] for seed in seeds if seed in self.index]] = True
+        seeded.comp_mask = ~seeded.seed_mask
+        return seeded
+
+    def seed_ids(self):
+        return np.flatnonzero(self.seed_mask)
+
+# N x P boolean matrix with one column per seed set (seeds outside the
+# interactome are dropped), for scoring many phenotypes at once
+def seed_indicator_matrix(graph, seed_sets):
+    S = np.zeros((graph.num_nodes, len(seed_sets)), dtype=bool)
+    for k, seeds in enumerate(seed_sets):
+        S[[graph.index[seed] for seed in seeds if seed in graph.index], k] = True
+    return S
+
+def build_graph_context(names, edges):
+    # edges is an (E x 2) array of node ids into names; each undirected edge
+    # is listed once and stored in both directions
+    numNodes = len(names)
+    edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+    rows = np.concatenate((edges[:,0], edges[:,1]))
+    cols = np.concatenate((edges[:,1], edges[:,0]))
+    A = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(numNodes, numNodes))
+    A.sum_duplicates()
+    A.sort_indices()
+    return GraphContext(names, A.indptr, A.indices)
+
+# All edges (v, w) leaving the nodes in frontier, as two flat id arrays
+def frontier_edges(graph, frontier):
+    counts = graph.degree[frontier]
+    offsets = np.cumsum(counts) - counts
+    src = np.repeat(frontier, counts)
+    pos = np.arange(counts.sum()) - np.repeat(offsets, counts) + np.repeat(graph.indptr[frontier], counts)
+    return src, graph.indices[pos]
+
+# Shortest path length (in edges) from source to every node; -1 if unreachable.
+# The BFS is level-synchronous, expanding a whole level with array operations.
+def bfs_distances(graph, source, dist=None):
+    if dist is None:
+        dist = np.empty(graph.num_nodes, dtype=np.int32)
+    dist.fill(-1)
+    dist[source] = 0
+    frontier = np.array([source], dtype=np.int32)
+    level = 0
+    while len(frontier):
+        level += 1
+        src, dst = frontier_edges(graph, frontier)
+        frontier = np.unique(dst[dist[dst] < 0])
+        dist[frontier] = level
+    return dist
+
+#----------------------------------------------------------------------------------------
+# Binary interactome format
+
+# Size, modification time and SHA-1 of the edge list file a binary
+# interactome is converted from
+def source_stamp(path):
+    sha1 = hashlib.sha1()
+    f = open(path, 'rb')
+    for block in iter(lambda: f.read(1 << 20), ''):
+        sha1.update(block)
+    f.close()
+    stat = os.stat(path)
+    return {'source_size': np.array(stat.st_size, dtype=np.int64),
+            'source_mtime': np.array(stat.st_mtime),
+            'source_sha1': np.array(sha1.hexdigest())}
+
+# Whether the binary interactome was converted from source_path as it is now.
+# Size and mtime are checked first; the SHA-1 settles a touched or copied file.
+def matches_source(binary_file, source_path):
+    arrays = np.load(binary_file)
+    if 'source_sha1' not in arrays.files:
+        return False
+    stat = os.stat(source_path)
+    if stat.st_size != int(arrays['source_size']):
+        return False
+    if stat.st_mtime == float(arrays['source_mtime']):
+        return True
+    return str(source_stamp(source_path)['source_sha1']) == str(arrays['source_sha1'])
+
+# Converts an edge list [('A','B'), ('B','C'), ...] to the binary format
+# arrays; source (see source_stamp) identifies the file the list came from
+def convert_edge_list(data, source=None):
+    names = sorted(set(protein for edge in data for protein in edge))
+    index = dict((name, i) for i, name in enumerate(names))
+    edges = np.array([(index[a], index[b]) for a, b in data], dtype=np.int32).reshape(-1, 2)
+
+    A = sparse.csr_matrix((np.ones(len(edges), dtype=np.int8), (edges[:,0], edges[:,1])), shape=(len(names), len(names)))
+    num_components, labels = connected_components(A, directed=False)
+    giant = labels == np.argmax(np.bincount(labels))
+
+    arrays = {'format': np.array(INTERACTOME_FORMAT),
+              'version': np.array(INTERACTOME_VERSION),
+              'names': np.array(names),
+              'edges': edges,
+              'giant': giant}
+    if source is not None:
+        arrays.update(source)
+    return arrays
+
+def save_binary_network(arrays, path):
+    tmp_path = '%s.%d.tmp.npz' %(path, os.getpid())
+    np.savez(tmp_path, **arrays)
+    os.rename(tmp_path, path)
+
+def load_binary_network(path):
+    arrays = np.load(path)
+    if str(arrays['format']) != INTERACTOME_FORMAT or int(arrays['version']) != INTERACTOME_VERSION:
+        raise ValueError('%s is not a version %d MADSS interactome' %(path, INTERACTOME_VERSION))
+    giant = arrays['giant']
+    edges = arrays['edges']
+
+    # keep the largest island; ids are renumbered in (sorted) table order
+    new_id = np.cumsum(giant, dtype=np.int32) - 1
+    edges = edges[giant[edges[:,0]]]
+    return build_graph_context(arrays['names'][giant].tolist(), new_id[edges])
+
+#----------------------------------------------------------------------------------------
+
+def load_network(binary_file="string700_data.npz", pickle_file="string700_data.p"):
+    if os.path.isfile(binary_file):
+        if not os.path.isfile(pickle_file) or matches_source(binary_file, pickle_file):
+            print "Loading STRING data from binary file"
+            graph = load_binary_network(binary_file)
+            print "Number of nodes:",graph.num_nodes
+            return graph
+        print "%s differs from the file %s was converted from" %(pickle_file, binary_file)
 
-def load_network():
     try:
         print "Loading STRING data from file"
-        data = pickle.load(open("string700_data.p", "rb") )
+        data = pickle.load(open(pickle_file, "rb") )
     except:
         # Note: data must be in the form [('A','B'), ('B','C'), ('A','D'), ('B', 'D'), ('E', 'F')]
         print "Loading STRING data from database"
@@ -57,28 +227,17 @@ def load_network():
         # dbConnection.commit()
         # dbConnection.close()
 
-    G = nx.Graph()
-    G.add_edges_from(data)
-    #print len(G)
-
-    print "Using NetworkX to find the largest island"
-    H = max(nx.connected_component_subgraphs(G), key=len)
-
-    ppi = dict()
-    node_list = []
-    for a, b in H.edges(): 
-        if not a in ppi:
-            ppi[a] = set()
-            node_list.append(a)
-        if not b in ppi:
-            ppi[b] = set()
-            node_list.append(b)
-        
-        ppi[a].add(b)
-        ppi[b].add(a)
+    print "Converting STRING data to binary file %s" %binary_file
+    source = source_stamp(pickle_file) if os.path.isfile(pickle_file) else None
+    save_binary_network(convert_edge_list(data, source), binary_file)
+
+    graph = load_binary_network(binary_file)
+    print "Number of nodes:",graph.num_nodes
+
+    return graph
 
-    #sorting all genes (to align with the adjacency matrix)
-    numNodes = len(ppi)
-    print "Number of nodes:",len(node_list)
 
-    return ppi, node_list, H
\ No newline at end of file
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python madss_interactome.py <edge list .p> <interactome .npz>')
+    save_binary_network(convert_edge_list(pickle.load(open(sys.argv[1], "rb")), source_stamp(sys.argv[1])), sys.argv[2])
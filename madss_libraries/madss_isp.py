@@ -23,107 +23,121 @@ Script to compute adapted inverse shortest path connectivity function.
 import os
 import sys
 import numpy as np
-import networkx as nx
-import cPickle as pickle
-
-def restart_line():
-    sys.stdout.write('\r')
-    sys.stdout.flush()
+import multiprocessing
+import madss_interactome
+import madss_cache
+import madss_telemetry
+import madss_results
 
 #----------------------------------------------------------------------------------------
 
-def calc_Sj_stored(H,j,seeds_left,isp_alls,complement):
-    isp_seeds = 0
-    isp_all   = isp_alls[j]
-            
+# Sum of 1/d(i,j) over seeds i != j for every node j, from one BFS per seed
+def calc_isp_seeds(graph, seeds_left):
+    isp_seeds = np.zeros(graph.num_nodes)
+    dist = np.empty(graph.num_nodes, dtype=np.int32)
     for i in seeds_left:
-        isp_temp = 0
-        if i != j:
-            isp_temp = 1 / float(nx.shortest_path_length(H,i,j))
-            isp_seeds += isp_temp
-    isp_comp = isp_all - isp_seeds
-    
-    numSeeds = isp_seeds / float(len(seeds_left))
+        madss_interactome.bfs_distances(graph, i, dist)
+        reached = dist > 0
+        isp_seeds[reached] += 1.0 / dist[reached]
+    return isp_seeds
+
+# 1/d(i,j) from each source i to every node j (zero for j = i and for nodes
+# that cannot be reached), one row per source
+def isp_rows(graph, sources):
+    rows = np.zeros((len(sources), graph.num_nodes))
+    dist = np.empty(graph.num_nodes, dtype=np.int32)
+    for k, i in enumerate(sources):
+        madss_interactome.bfs_distances(graph, i, dist)
+        reached = dist > 0
+        rows[k, reached] = 1.0 / dist[reached]
+    return rows
+
+# isp_all[j] = sum over i != j of 1/d(i,j), which by symmetry is the harmonic
+# sum of a single BFS rooted at j
+def harmonic_sums(graph, sources):
+    sums = np.zeros(len(sources))
+    dist = np.empty(graph.num_nodes, dtype=np.int32)
+    for k, j in enumerate(sources):
+        madss_interactome.bfs_distances(graph, j, dist)
+        sums[k] = (1.0 / dist[dist > 0]).sum()
+    return sums
+
+# Sources are spread over a process pool in chunks; workers inherit the graph
+# from the parent process on fork.
+_pool_graph = None
+
+def _harmonic_chunk(chunk):
+    return chunk, harmonic_sums(_pool_graph, chunk)
+
+def calc_isp_alls(graph, processes=1, chunk_size=256):
+    global _pool_graph
+    numNodes = graph.num_nodes
+    if processes == 1:
+        return harmonic_sums(graph, range(numNodes))
+
+    isp_alls = np.zeros(numNodes)
+    chunks = [range(start, min(start+chunk_size, numNodes)) for start in xrange(0, numNodes, chunk_size)]
+    _pool_graph = graph
+    pool = multiprocessing.Pool(processes)
+    done = 0
+    try:
+        for chunk, sums in pool.imap_unordered(_harmonic_chunk, chunks):
+            isp_alls[chunk] = sums
+            done += 1
+            madss_telemetry.progress('ISP chunks', done, len(chunks))
+    finally:
+        madss_telemetry.progress('ISP chunks', done, len(chunks), final=True)
+        pool.close()
+        pool.join()
+        _pool_graph = None
+    return isp_alls
+
+# Sj for all nodes at once from the seed and all-node ISP sums. For many seed
+# sets at once, pass N x P seed sums, isp_alls as an N x 1 column and P seed
+# and complement counts.
+def calc_Sj_stored(isp_seeds,isp_alls,numSeeds,numComplement):
+    isp_comp = isp_alls - isp_seeds
     
-    numComp = isp_comp / float(len(complement))
+    inSeeds = isp_seeds / np.asarray(numSeeds, dtype=float)
     
-    denominator = isp_all / float(len(H))
+    numComp = isp_comp / np.asarray(numComplement, dtype=float)
     
-    Sj = (numSeeds - numComp) / float(denominator)
+    denominator = isp_alls / float(len(isp_alls))
     
-    #print j,Sj,isp_seeds,isp_comp,isp_all
+    Sj = (inSeeds - numComp) / denominator
     
     return Sj
 #----------------------------------------------------------------------------------------
 
-def calc_isp_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds):
-    seeds_left = []
-    for node in node_list:
-        for seed in seeds:
-            if node == seed:
-                if not node in seeds_left:
-                    seeds_left.append(node)
-    # print "Number of seeds left:",len(seeds_left)
-
-    complement = []
-    for node in node_list:
-        if not node in seeds_left:
-            if not node in complement:
-                complement.append(node)
-
-    # Try to load stored vals, otherwise create
-    try:
-        isp_alls = pickle.load(open("stored_vals/string700_isp_alls.p", "rb") )
-        print "stored values loaded"
-    except:
-        # Calculate isp_all
+# Loads stored vals, building them on a cache miss
+def load_isp_alls(graph, processes=1):
+    def build_isp_alls():
         print "building ISP dictionary...",
         sys.stdout.flush()
-        isp_alls = dict()
-
-        node_count = 0
-        for j in H:
-            isp_all = 0
-
-            for i in H:
-                isp_temp = 0
-                if i != j:
-                    isp_temp = 1 / float(nx.shortest_path_length(H,i,j))
-                    isp_all += isp_temp
-            
-            isp_alls[j] = isp_all
-            
-            node_count += 1
-            if node_count % 500 == 0:
-                print node_count,
-                sys.stdout.flush()
-        pickle.dump(isp_alls, open("stored_vals/string700_isp_alls.p", "wb"))
+        isp_alls = calc_isp_alls(graph, processes)
         print 'done',len(isp_alls),'\n'
+        return isp_alls
 
+    return madss_cache.cached(graph, 'isp_alls', 1, build_isp_alls,
+                              legacy=lambda: madss_cache.legacy_pickle(graph, "stored_vals/string700_isp_alls.p"))
 
-    Sj_dict = dict()
+def calc_isp_Sj(graph, ADVERSE_EVENT, processes=1):
+    numNodes = graph.num_nodes
+    seeds_left = graph.seed_ids().tolist()
+    numComplement = np.count_nonzero(graph.comp_mask)
 
-    #----- Calc Sj ---------
-    for i, j in enumerate(H):
-        sys.stdout.write('Calculating Sj for node: %s (Index %d): ' %(j,i)),
+    isp_alls = load_isp_alls(graph, processes)
+    print "stored values loaded"
 
-        Sj_dict[j] = calc_Sj_stored(H,j,seeds_left,isp_alls,complement)
-
-        sys.stdout.write('%s' %Sj_dict[j])
-        sys.stdout.flush()
-        restart_line()
-
-    Sj_file = open('results/isp_Sj_%s.txt' %ADVERSE_EVENT, 'w')
-    neighborhood = []
+    #----- Calc Sj ---------
+    print "Calculating Sj...",
+    sys.stdout.flush()
+    isp_seeds = calc_isp_seeds(graph, seeds_left)
+    Sj_vector = calc_Sj_stored(isp_seeds, isp_alls, len(seeds_left), numComplement)
+    print 'done'
 
-    for j in H:
-        Sj_file.write("%s\t%s\n" %(Sj_dict[j],j))
-        if Sj_dict[j] > 0:
-            if not j in neighborhood:
-                neighborhood.append(j)
+    Sj_dict = madss_results.write_Sj_file('isp', ADVERSE_EVENT, graph, Sj_vector)
 
-    #print "Number of Sj values:",len(Sj_dict)
-    print "\nNeighborhood size:",len(neighborhood)
+    print "\nNeighborhood size:",np.count_nonzero(Sj_vector > 0)
 
-    Sj_file.close()
-    return Sj_dict
\ No newline at end of file
+    return Sj_dict
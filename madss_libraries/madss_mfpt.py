@@ -21,87 +21,225 @@ Snell Finite Markov Chains (1960) pp 78-.
 
 """
 
-import os
 import sys
-import csv
 import numpy as np
-import networkx as nx
-
-def restart_line():
-    sys.stdout.write('\r')
+from scipy import sparse
+from scipy.sparse.linalg import splu
+import madss_cache
+import madss_results
+
+#----------------------------------------------------------------------------------------
+# Sparse MFPT engine
+#
+# The dense path forms B = inv(K - A + K*ones) and the full mfptMatrix
+# M[i,j] = m*(B[j,j] - B[i,j]), where m = A.sum(). The Sj formula only needs
+# three column aggregates of M (all nodes, seeds, complement), and these follow
+# from diag(B) and the seed rows of B:
+#   sum_i M[i,j]       = m*N*B[j,j] - 1          (columns of B sum to 1/m)
+#   sum_{i in S} M[i,j] = m*(|S|*B[j,j] - (s'B)[j])
+# Both are obtained from a sparse factorization of the Laplacian grounded at
+# node 0 (L with row/column 0 removed, which is nonsingular for a connected
+# graph), so no N x N array is ever formed.
+
+def _grounded_solver(A):
+    degree = np.asarray(A.sum(1)).ravel()
+    L = sparse.diags(degree) - A
+    # the grounded Laplacian is symmetric, so order on A+A' to keep fill-in low
+    lu = splu(sparse.csc_matrix(L[1:,1:]), permc_spec='MMD_AT_PLUS_A', options=dict(SymmetricMode=True))
+
+    # Applies the grounded inverse G: x[1:] = inv(L[1:,1:]) rhs[1:], x[0] = 0
+    def solve(rhs):
+        rhs = np.asarray(rhs, dtype=float)
+        x = np.zeros(rhs.shape)
+        x[1:] = lu.solve(np.ascontiguousarray(rhs[1:]))
+        return x
+
+    return solve, degree
+
+# diag of the grounded inverse G, computed block by block so that only an
+# N x block_size slab is held at a time. This is the expensive, seed-independent
+# part of the sparse engine and is what gets cached. Pass the (solve, degree)
+# pair of _grounded_solver to reuse a factorization.
+def grounded_inverse_diag(A, block_size=256, solver=None):
+    numNodes = A.shape[0]
+    solve, degree = solver or _grounded_solver(A)
+    G_diag = np.zeros(numNodes)
+    for start in xrange(1, numNodes, block_size):
+        stop = min(start + block_size, numNodes)
+        E = np.zeros((numNodes, stop - start))
+        E[np.arange(start, stop), np.arange(stop - start)] = 1.0
+        X = solve(E)
+        G_diag[start:stop] = X[np.arange(start, stop), np.arange(stop - start)]
+    return G_diag
+
+# Seed-independent part of the sparse engine: diag(B), the total edge weight m,
+# and the grounded Laplacian solver that is reused for the seed rows of B.
+# The Laplacian is factorized once, here or by the caller (solver).
+def mfpt_column_data(A, G_diag=None, solver=None):
+    numNodes = A.shape[0]
+    solver = solver or _grounded_solver(A)
+    solve, degree = solver
+    m = degree.sum()
+
+    if G_diag is None:
+        G_diag = grounded_inverse_diag(A, solver=solver)
+
+    g = solve(degree)
+    h = solve(np.ones(numNodes))
+    alpha = (1.0/m - h + g.sum()/m) / numNodes
+    B_diag = G_diag - g/m + alpha
+
+    return {'B_diag': B_diag, 'g': g, 'alpha': alpha, 'm': m, 'solve': solve}
+
+def load_column_data(graph):
+    A = graph.adjacency()
+    solver = _grounded_solver(A)
+    G_diag = madss_cache.cached(graph, 'mfpt_grounded_diag', 1, lambda: grounded_inverse_diag(A, solver=solver))
+    return mfpt_column_data(A, G_diag, solver)
+
+# Returns the all-node column sums (N,) and the seed-set column sums (N x P) of
+# the MFPT matrix for an N x P seed-indicator matrix (one column per seed set)
+def sparse_mfpt_aggregates(A, seed_matrix, column_data=None):
+    if column_data is None:
+        column_data = mfpt_column_data(A)
+    numNodes = A.shape[0]
+    B_diag = column_data['B_diag']
+    m = column_data['m']
+
+    S = np.asarray(seed_matrix, dtype=float).reshape(numNodes, -1)
+    numSeeds = S.sum(0)
+    # s'B[:,j] = (G s)[j] - s.g/m + alpha[j]*|S|, for all seed sets in one block solve
+    seedRows = column_data['solve'](S) - S.T.dot(column_data['g'])/m + np.outer(column_data['alpha'], numSeeds)
+
+    allSums = sparse_column_sums(column_data)
+    seedSums = m*(np.outer(B_diag, numSeeds) - seedRows)
+    return allSums, seedSums
+
+# All-node column sums of the MFPT matrix from the sparse column data
+def sparse_column_sums(column_data):
+    return column_data['m']*len(column_data['B_diag'])*column_data['B_diag'] - 1.0
+
+# Rows of the MFPT matrix for the given sources (k x N), each row being one
+# seed's contribution to the seed-set column sums
+def mfpt_rows(column_data, sources):
+    B_diag = column_data['B_diag']
+    m = column_data['m']
+    sources = np.asarray(sources, dtype=np.int64)
+    E = np.zeros((len(B_diag), len(sources)))
+    E[sources, np.arange(len(sources))] = 1.0
+    seedRows = column_data['solve'](E) - column_data['g'][sources]/m + column_data['alpha'][:,np.newaxis]
+    return (m*(B_diag[:,np.newaxis] - seedRows)).T
+
+#----------------------------------------------------------------------------------------
+
+def form_mfpt_matrix(graph):
+    A = graph.adjacency().toarray()
+    # Note, for this to work (i.e. K be the correct shape) A must be a 2D array, not a matrix.
+    print "Forming mfpt matrix...",
+    K = np.diag(A.sum(1))
+    B = np.linalg.inv((K-A + np.dot(K, np.ones(A.shape))))
+    mfptMatrix = A.sum()*( np.dot( np.ones(A.shape),np.diag(np.diag(B)) ) - B )
+    return mfptMatrix
+
+# A pre-cache stored_vals/mfptMatrix.npy carries no protein ids, so it is only
+# accepted when importing is enabled and its shape matches the interactome
+def _legacy_mfpt_matrix(graph):
+    if not madss_cache.legacy_allowed('stored_vals/mfptMatrix.npy'):
+        return None
+    mfptMatrix = np.load('stored_vals/mfptMatrix.npy')
+    if mfptMatrix.shape != (graph.num_nodes, graph.num_nodes):
+        print "Ignoring stored_vals/mfptMatrix.npy: its shape does not match the interactome"
+        return None
+    print "Importing stored_vals/mfptMatrix.npy into the cache"
+    return mfptMatrix
+
+#----------------------------------------------------------------------------------------
+# Memory-mapped MFPT matrix store. The matrix is kept in the cache as .npy
+# (optionally as float32, halving its size) and opened read-only with
+# mmap_mode, so processes on one host share the mapped pages. A sidecar with
+# the column sums is cached alongside it; with the sidecar, scoring only reads
+# the rows of the seeds.
+
+def _mfpt_store_name(dtype):
+    dtype = np.dtype(dtype)
+    return 'mfpt_matrix' if dtype == np.float64 else 'mfpt_matrix_%s' %dtype.name
+
+def load_mfpt_matrix(graph, dtype=np.float64):
+    print "Loading mfpt matrix...",
     sys.stdout.flush()
-
-def calc_mfpt_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds):
-    #sorting all genes (to align with the adjacency matrix)
-    numNodes = len(ppi)
-    sorted_reachable = sorted(ppi)
-
-    seeds = [gene for gene in seeds if gene in ppi]
-    seedIndices = [sorted_reachable.index(gene) for gene in seeds]
-    complementIndices = list(set(range(len(sorted_reachable))) - set(seedIndices))
-
-    #calculate mfpt matrix
-    A = np.zeros(shape=(numNodes,numNodes))
-    for i,a in enumerate(sorted_reachable):
-        for j,b in enumerate(sorted_reachable):
-            if b in ppi[a]:
-                A[i,j] = 1
-                A[j,i] = 1
-
-    if os.path.isfile('stored_vals/mfptMatrix.npy'):
-        print "Loading mfpt matrix...",
-        sys.stdout.flush()
-        mfptMatrix = np.load('stored_vals/mfptMatrix.npy')
-    else:
-        # Note, for this to work (i.e. K be the correct shape) A must be a 2D array, not a matrix.
-        print "Forming mfpt matrix...",
-        K = np.diag(A.sum(1))
-        B = np.linalg.inv((K-A + np.dot(K, np.ones(A.shape))))
-        mfptMatrix = A.sum()*( np.dot( np.ones(A.shape),np.diag(np.diag(B)) ) - B )
-        if not os.path.exists('stored_vals'):
-            os.makedirs('stored_vals')
-        np.save('stored_vals/mfptMatrix.npy', mfptMatrix)
+    mfptMatrix = madss_cache.cached(graph, _mfpt_store_name(dtype), 1,
+                                    lambda: form_mfpt_matrix(graph).astype(dtype, copy=False),
+                                    legacy=lambda: _legacy_mfpt_matrix(graph),
+                                    mmap_mode='r')
     print 'done'
-
-    Sjs = []
-        
-    for (geneIndex, geneName) in enumerate(sorted_reachable):
-        sys.stdout.write('Calculating Sj for node %s (Index %d): ' %(geneName,geneIndex)),
-
-        denominator = sum(mfptMatrix[:,geneIndex]) / numNodes
-
-        inSet = sum(mfptMatrix[seedIndices,geneIndex])/len(seeds)
-
-        complement = sum(mfptMatrix[complementIndices,geneIndex])/len(complementIndices)
-
-        Sj = (complement - inSet) / denominator
-        Sjs.append((Sj,sorted_reachable[geneIndex]))
-
-        sys.stdout.write("%s" %Sj)
+    return mfptMatrix
+
+# Column sums accumulated in float64 over blocks of rows of the (mapped) matrix
+def mfpt_column_sums(mfptMatrix, block_size=1024):
+    numNodes = mfptMatrix.shape[0]
+    allSums = np.zeros(numNodes)
+    for start in xrange(0, numNodes, block_size):
+        allSums += mfptMatrix[start:start+block_size].sum(0, dtype=np.float64)
+    return allSums
+
+def load_mfpt_column_sums(graph, dtype=np.float64):
+    return madss_cache.cached(graph, _mfpt_store_name(dtype) + '_column_sums', 1,
+                              lambda: mfpt_column_sums(load_mfpt_matrix(graph, dtype)))
+
+# Column sums of a stored mfptMatrix, with the seed-set sums for all seed sets
+# taken as one matrix product S'M over the rows that hold at least one seed
+def dense_mfpt_aggregates(mfptMatrix, seed_matrix, allSums=None):
+    numNodes = mfptMatrix.shape[0]
+    S = np.asarray(seed_matrix, dtype=float).reshape(numNodes, -1)
+    if allSums is None:
+        allSums = mfpt_column_sums(mfptMatrix)
+    seedRows = np.flatnonzero(S.any(1))
+    seedSums = S[seedRows].T.dot(np.asarray(mfptMatrix[seedRows], dtype=np.float64))
+    return allSums, seedSums.T
+
+# Sj for many seed sets at once: seed_matrix is N x P (see
+# madss_interactome.seed_indicator_matrix) and the result is N x P
+def mfpt_Sj_matrix(graph, seed_matrix, sparse_engine=True, column_data=None, dtype=np.float64):
+    numNodes = graph.num_nodes
+    S = np.asarray(seed_matrix, dtype=float).reshape(numNodes, -1)
+    numSeeds = S.sum(0)
+
+    if sparse_engine:
+        if column_data is None:
+            column_data = load_column_data(graph)
+        allSums, seedSums = sparse_mfpt_aggregates(graph.adjacency(), S, column_data)
+    else:
+        allSums, seedSums = dense_mfpt_aggregates(load_mfpt_matrix(graph, dtype), S,
+                                                  load_mfpt_column_sums(graph, dtype))
+    return calc_Sj_stored(allSums, seedSums, numSeeds)
+
+# Sj from the all-node (N,) and seed-set column sums of the MFPT matrix; for
+# many seed sets at once, seedSums is N x P and numSeeds holds P counts
+def calc_Sj_stored(allSums, seedSums, numSeeds):
+    numNodes = len(allSums)
+    numComplement = numNodes - np.asarray(numSeeds, dtype=float)
+    if np.ndim(seedSums) == 2:
+        allSums = allSums[:,np.newaxis]
+    compSums = allSums - seedSums
+
+    denominator = allSums / numNodes
+    inSet = seedSums / np.asarray(numSeeds, dtype=float)
+    complement = compSums / numComplement
+    return (complement - inSet) / denominator
+
+def calc_mfpt_Sj(graph, ADVERSE_EVENT, sparse_engine=True, dtype=np.float64):
+    # node ids in graph follow the sorted protein ids (to align with the adjacency matrix)
+    if sparse_engine:
+        print "Forming sparse mfpt column aggregates...",
         sys.stdout.flush()
-        restart_line()
-
-    sorted_Sjs = sorted(Sjs)
-    sorted_Sjs.reverse()
+    Sj_vector = mfpt_Sj_matrix(graph, graph.seed_mask, sparse_engine, dtype=dtype)[:,0]
+    if sparse_engine:
+        print 'done'
 
     print 'Sjs calculated.'
     # save Sjs for later use
-    sj_file_handler = open('results/mfpt_Sj_%s.txt' %(ADVERSE_EVENT),'w')
-    sj_writer = csv.writer(sj_file_handler)
-
-    Sj_dict = dict()
-    neighborhood = []
-    for i, (sj, geneName) in enumerate(sorted_Sjs):
-        sj_writer.writerow([sj, geneName])
-        Sj_dict[geneName] = sj
-
-        if sj > 0:
-            if not geneName in neighborhood:
-                neighborhood.append(geneName)
-
-    #print "Number of Sj values:",len(sorted_Sjs)
-    print "Neighborhood size:",len(neighborhood)
+    Sj_dict = madss_results.write_Sj_file('mfpt', ADVERSE_EVENT, graph, Sj_vector)
 
-    sj_file_handler.close()
+    print "Neighborhood size:",np.count_nonzero(Sj_vector > 0)
 
     return Sj_dict
\ No newline at end of file
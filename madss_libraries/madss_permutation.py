@@ -0,0 +1,163 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Degree-matched permutation test of Sj scores. Random seed sets are drawn so
+that each real seed is replaced by a node of similar degree (nodes are binned
+by degree). They are scored in batches against the seed-independent
+aggregates (see madss_engine.score_seed_matrix). Each node gets an empirical
+p-value for each connectivity function, the fraction of random seed sets
+scoring it at least as high as the real seeds, and a Benjamini-Hochberg
+q-value across nodes. Run from the MADSS folder, for example:
+python madss_libraries/madss_permutation.py MI --permutations=1000 --processes=4
+Results are written to results/<AE>_permutation.csv.
+
+"""
+
+import os
+import sys
+import csv
+import time
+import numpy as np
+import madss_interactome
+import madss_engine
+import madss_seeds
+import madss_telemetry
+
+# Nodes grouped by degree, lowest first. Nodes of equal degree stay together
+# and a bin is closed once it holds min_bin_size nodes; a smaller remainder
+# joins the last bin.
+def degree_bins(graph, min_bin_size=100):
+    order = np.argsort(graph.degree, kind='mergesort')
+    boundaries = np.flatnonzero(np.diff(graph.degree[order])) + 1
+    bins = []
+    start = 0
+    for boundary in boundaries:
+        if boundary - start >= min_bin_size:
+            bins.append(order[start:boundary])
+            start = boundary
+    if start < graph.num_nodes:
+        if bins and graph.num_nodes - start < min_bin_size:
+            bins[-1] = np.concatenate((bins[-1], order[start:]))
+        else:
+            bins.append(order[start:])
+    return bins
+
+# N x num_sets seed matrix of random seed sets, each drawing as many distinct
+# nodes from every degree bin as there are real seeds in it
+def degree_matched_seed_sets(graph, seed_ids, num_sets, bins, random_state):
+    node_bin = np.empty(graph.num_nodes, dtype=np.int64)
+    for k, members in enumerate(bins):
+        node_bin[members] = k
+    seeds_per_bin = np.bincount(node_bin[seed_ids], minlength=len(bins))
+
+    seed_matrix = np.zeros((graph.num_nodes, num_sets), dtype=bool)
+    for k in np.flatnonzero(seeds_per_bin):
+        members = bins[k]
+        picks = random_state.rand(num_sets, len(members)).argsort(1)[:,:seeds_per_bin[k]]
+        seed_matrix[members[picks], np.arange(num_sets)[:,np.newaxis]] = True
+    return seed_matrix
+
+def benjamini_hochberg(p_values):
+    p_values = np.asarray(p_values, dtype=float)
+    order = np.argsort(p_values)
+    q_values = p_values[order] * len(p_values) / np.arange(1, len(p_values)+1)
+    q_values = np.minimum.accumulate(q_values[::-1])[::-1]
+    adjusted = np.empty(len(p_values))
+    adjusted[order] = np.minimum(q_values, 1.0)
+    return adjusted
+
+# Returns the seeded graph and {metric: {'Sj', 'p', 'q'}} vectors in graph
+# order. Random seed sets are scored batch_size at a time, which bounds memory
+# at a few N x batch_size matrices.
+def permutation_test(graph, aggregates, seeds, num_permutations=1000, metrics=madss_engine.METRICS,
+                     batch_size=500, min_bin_size=100, processes=1, random_state=0):
+    graph = graph.with_seeds(seeds)
+    seed_ids = graph.seed_ids()
+    observed = madss_engine.score_seed_matrix(graph, aggregates, graph.seed_mask, metrics, processes)
+
+    bins = degree_bins(graph, min_bin_size)
+    random_state = np.random.RandomState(random_state)
+    exceed = dict((METRIC, np.zeros(graph.num_nodes)) for METRIC in metrics)
+    done = 0
+    while done < num_permutations:
+        num_sets = min(batch_size, num_permutations - done)
+        seed_matrix = degree_matched_seed_sets(graph, seed_ids, num_sets, bins, random_state)
+        null_Sj = madss_engine.score_seed_matrix(graph, aggregates, seed_matrix, metrics, processes)
+        for METRIC in metrics:
+            exceed[METRIC] += (null_Sj[METRIC] >= observed[METRIC]).sum(1)
+        done += num_sets
+        madss_telemetry.progress('Random seed sets scored', done, num_permutations)
+    madss_telemetry.progress('Random seed sets scored', done, num_permutations, final=True)
+
+    results = dict()
+    for METRIC in metrics:
+        Sj_vector = observed[METRIC][:,0]
+        p_values = (exceed[METRIC] + 1.0) / (num_permutations + 1.0)
+        p_values[np.isnan(Sj_vector)] = 1.0
+        results[METRIC] = {'Sj': Sj_vector, 'p': p_values, 'q': benjamini_hochberg(p_values)}
+    return graph, results
+
+# Writes results/<AE>_permutation.csv and reports, for each metric, the
+# neighborhood (Sj > 0) and the part of it with q <= alpha
+def save_permutation_results(ADVERSE_EVENT, graph, results, alpha=0.05):
+    metrics = [METRIC for METRIC in madss_engine.METRICS if METRIC in results]
+    if not os.path.exists('results'):
+        os.makedirs('results')
+    outf = open('results/%s_permutation.csv' %ADVERSE_EVENT, 'w')
+    writer = csv.writer(outf)
+    writer.writerow(['protein_id', 'seed'] + sum([[METRIC + '_Sj', METRIC + '_p', METRIC + '_q'] for METRIC in metrics], []))
+    for i, node in enumerate(graph.names):
+        row = [node, int(graph.seed_mask[i])]
+        for METRIC in metrics:
+            row += [results[METRIC]['Sj'][i], results[METRIC]['p'][i], results[METRIC]['q'][i]]
+        writer.writerow(row)
+    outf.close()
+
+    for METRIC in metrics:
+        in_neighborhood = results[METRIC]['Sj'] > 0
+        significant = in_neighborhood & (results[METRIC]['q'] <= alpha)
+        print "%s neighborhood size: %d, significant at FDR %.2f: %d" %(METRIC.upper(), np.count_nonzero(in_neighborhood), alpha, np.count_nonzero(significant))
+    print "Permutation results written to results/%s_permutation.csv" %ADVERSE_EVENT
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    phenotypes = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(phenotypes) != 1:
+        sys.exit('Usage: python madss_libraries/madss_permutation.py MI [--seed-file=seeds.tsv] [--permutations=1000] '
+                 '[--alpha=0.05] [--min-bin-size=100] [--processes=1] [--random-seed=0]')
+    ADVERSE_EVENT = phenotypes[0]
+    if 'seed-file' in options:
+        seed_sets = madss_seeds.read_seed_file(options['seed-file'])
+    else:
+        seed_sets = madss_seeds.PHENOTYPE_SEEDS
+    if ADVERSE_EVENT not in seed_sets:
+        sys.exit('Error: no seeds defined for %s. Exiting.' %ADVERSE_EVENT)
+
+    processes = int(options.get('processes', 1)) or None
+    graph = madss_interactome.load_network()
+    aggregates = madss_engine.load_aggregates(graph, processes)
+
+    start = time.time()
+    graph, results = permutation_test(graph, aggregates, seed_sets[ADVERSE_EVENT],
+                                      num_permutations=int(options.get('permutations', 1000)),
+                                      min_bin_size=int(options.get('min-bin-size', 100)),
+                                      processes=processes,
+                                      random_state=int(options.get('random-seed', 0)))
+    print "Permutation test finished in %.1fs" %(time.time() - start)
+    save_permutation_results(ADVERSE_EVENT, graph, results, float(options.get('alpha', 0.05)))
@@ -0,0 +1,160 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Columnar results artifact for one phenotype, results/<AE>_Sj.npz. It holds
+the protein ids, the seed mask, one Sj vector per connectivity function
+(NaN when a function has not been run) and a JSON metadata string (phenotype,
+seeds, interactome fingerprint, format version). Members are stored
+uncompressed, so load_results maps them straight from the file without
+copying or parsing.
+
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import struct
+import zipfile
+import numpy as np
+import madss_cache
+
+RESULTS_FORMAT = 'MADSS-results'
+RESULTS_VERSION = 1
+METRICS = ['mfpt', 'bc', 'sn', 'isp']
+
+def results_path(ADVERSE_EVENT):
+    return 'results/%s_Sj.npz' %ADVERSE_EVENT
+
+# Per-function text file results/<METRIC>_Sj_<AE>.txt: MFPT as CSV sorted by
+# descending Sj, the others tab-separated in graph order. Returns {protein_id: Sj}
+def write_Sj_file(METRIC, ADVERSE_EVENT, graph, Sj_vector):
+    Sjs = zip(np.asarray(Sj_vector).tolist(), graph.names)
+    Sj_file = open('results/%s_Sj_%s.txt' %(METRIC, ADVERSE_EVENT), 'w')
+    if METRIC == 'mfpt':
+        Sjs.sort(reverse=True)
+        sj_writer = csv.writer(Sj_file)
+        for sj, geneName in Sjs:
+            sj_writer.writerow([sj, geneName])
+    else:
+        for Sj, node in Sjs:
+            Sj_file.write("%s\t%s\n" %(Sj, node))
+    Sj_file.close()
+
+    return dict((node, Sj) for Sj, node in Sjs)
+
+# Sj_scores maps each connectivity function that was run to {protein_id: Sj}
+# or to an Sj vector in graph order; functions missing from Sj_scores are
+# carried over from previous (the results loaded before the run), if given
+def save_results(ADVERSE_EVENT, graph, Sj_scores, path=None, previous=None):
+    if path is None:
+        path = results_path(ADVERSE_EVENT)
+    if not os.path.exists(os.path.dirname(path) or '.'):
+        os.makedirs(os.path.dirname(path))
+
+    Sj_scores = dict(Sj_scores)
+    if previous is not None:
+        for METRIC in previous['metadata']['metrics']:
+            if METRIC not in Sj_scores:
+                Sj_scores[METRIC] = previous[METRIC]
+
+    arrays = {'names': np.array(graph.names), 'seed_mask': graph.seed_mask}
+    for METRIC in METRICS:
+        Sj_vector = np.empty(graph.num_nodes)
+        Sj_vector.fill(np.nan)
+        if METRIC in Sj_scores:
+            Sj_list = Sj_scores[METRIC]
+            if isinstance(Sj_list, dict):
+                Sj_vector = np.array([Sj_list.get(node, np.nan) for node in graph.names])
+            else:
+                Sj_vector = np.asarray(Sj_list, dtype=float)
+        arrays[METRIC] = Sj_vector
+
+    metadata = {'format': RESULTS_FORMAT,
+                'version': RESULTS_VERSION,
+                'adverse_event': ADVERSE_EVENT,
+                'seeds': [graph.names[i] for i in graph.seed_ids()],
+                'fingerprint': madss_cache.graph_fingerprint(graph),
+                'metrics': [METRIC for METRIC in METRICS if METRIC in Sj_scores],
+                'created': time.time()}
+    arrays['metadata'] = np.array(json.dumps(metadata))
+
+    tmp_path = '%s.%d.tmp.npz' %(path, os.getpid())
+    np.savez(tmp_path, **arrays)
+    os.rename(tmp_path, path)
+
+# Maps each uncompressed member of an .npz as a read-only np.memmap; anything
+# that cannot be mapped (compressed, empty or 0-d members) is read normally
+def _map_npz(path):
+    arrays = dict()
+    archive = zipfile.ZipFile(path)
+    f = open(path, 'rb')
+    try:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                f.seek(info.header_offset)
+                name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                if len(shape) > 0 and np.prod(shape) > 0 and not dtype.hasobject:
+                    arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(),
+                                             shape=shape, order='F' if fortran_order else 'C')
+                    continue
+            arrays[name] = np.lib.format.read_array(io.BytesIO(archive.read(info.filename)))
+    finally:
+        f.close()
+        archive.close()
+    return arrays
+
+# Returns the results for ADVERSE_EVENT as a dict of arrays plus 'metadata',
+# or None if there are none. With graph given, results computed on a different
+# interactome or seed set are treated as absent.
+def load_results(ADVERSE_EVENT, graph=None, path=None):
+    if path is None:
+        path = results_path(ADVERSE_EVENT)
+    if not os.path.isfile(path):
+        return None
+
+    results = _map_npz(path)
+    metadata = json.loads(str(results['metadata']))
+    if metadata.get('format') != RESULTS_FORMAT or metadata.get('version') != RESULTS_VERSION:
+        print "Ignoring %s: unknown results format" %path
+        return None
+    results['metadata'] = metadata
+
+    if graph is not None:
+        if metadata['fingerprint'] != madss_cache.graph_fingerprint(graph):
+            print "Ignoring %s: computed on a different interactome" %path
+            return None
+        if not np.array_equal(results['seed_mask'], graph.seed_mask):
+            print "Ignoring %s: computed for a different seed set" %path
+            return None
+    return results
+
+# {protein_id: Sj} for one connectivity function, or None if it was not run
+def Sj_dict(results, METRIC):
+    if METRIC not in results['metadata']['metrics']:
+        return None
+    return dict(zip(results['names'].tolist(), results[METRIC].tolist()))
@@ -0,0 +1,141 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Runs the connectivity functions for one phenotype side by side. Each function
+gets its own forked process, which shares the parent's interactome arrays
+copy-on-write instead of receiving a pickled copy. Results are collected as
+each process finishes, and the wall time of each function is reported. A
+function's console output goes to results/<metric>_<AE>.log while they run
+concurrently.
+
+"""
+
+import os
+import sys
+import time
+import Queue
+import traceback
+import multiprocessing
+import numpy as np
+import madss_telemetry
+
+METRIC_NAMES = {'mfpt': 'mean first passage time',
+                'bc': 'betweenness centrality',
+                'sn': 'shared neighbors',
+                'isp': 'inverse shortest path'}
+
+def calc_Sj(METRIC, graph, ADVERSE_EVENT, processes=1):
+    with madss_telemetry.span('calc_%s_Sj' %METRIC, adverse_event=ADVERSE_EVENT):
+        return _calc_Sj(METRIC, graph, ADVERSE_EVENT, processes)
+
+def _calc_Sj(METRIC, graph, ADVERSE_EVENT, processes=1):
+    if METRIC == 'mfpt':
+        import madss_mfpt
+        return madss_mfpt.calc_mfpt_Sj(graph, ADVERSE_EVENT)
+    elif METRIC == 'bc':
+        import madss_bc
+        return madss_bc.calc_bc_Sj(graph, ADVERSE_EVENT, processes)
+    elif METRIC == 'sn':
+        import madss_sn
+        return madss_sn.calc_sn_Sj(graph, ADVERSE_EVENT)
+    elif METRIC == 'isp':
+        import madss_isp
+        return madss_isp.calc_isp_Sj(graph, ADVERSE_EVENT, processes)
+    raise ValueError('unknown connectivity function %s' %METRIC)
+
+# Body of each metric process: sends (METRIC, Sj vector in graph order,
+# seconds, error, telemetry records)
+def _metric_process(METRIC, graph, ADVERSE_EVENT, processes, results):
+    start = time.time()
+    madss_telemetry.reset()
+    stdout = sys.stdout
+    sys.stdout = open('results/%s_%s.log' %(METRIC, ADVERSE_EVENT), 'w')
+    try:
+        Sj_dict = calc_Sj(METRIC, graph, ADVERSE_EVENT, processes)
+        Sj_vector = np.array([Sj_dict[node] for node in graph.names])
+        results.put((METRIC, Sj_vector, time.time() - start, None, madss_telemetry.snapshot()))
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        results.put((METRIC, None, time.time() - start, traceback.format_exc().strip().splitlines()[-1],
+                     madss_telemetry.snapshot()))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def _run_concurrently(graph, ADVERSE_EVENT, metrics, processes):
+    results = multiprocessing.Queue()
+    workers = dict()
+    for METRIC in metrics:
+        workers[METRIC] = multiprocessing.Process(target=_metric_process, args=(METRIC, graph, ADVERSE_EVENT, processes, results))
+        workers[METRIC].start()
+    print "Running %s concurrently" %', '.join(METRIC.upper() for METRIC in metrics)
+    sys.stdout.flush()
+
+    Sj_scores = dict()
+    timings = dict()
+    errors = dict()
+    try:
+        while len(Sj_scores) + len(errors) < len(metrics):
+            try:
+                METRIC, Sj_vector, seconds, error, records = results.get(timeout=1)
+            except Queue.Empty:
+                # a process that died without reporting (e.g. killed for memory)
+                for METRIC, worker in workers.iteritems():
+                    if not worker.is_alive() and METRIC not in Sj_scores and METRIC not in errors and results.empty():
+                        errors[METRIC] = 'process exited with code %s' %worker.exitcode
+                continue
+            timings[METRIC] = seconds
+            madss_telemetry.merge(records, worker=METRIC)
+            if error is not None:
+                errors[METRIC] = error
+                continue
+            Sj_scores[METRIC] = dict(zip(graph.names, Sj_vector.tolist()))
+            print "%s finished in %.1fs, neighborhood size: %d" %(METRIC.upper(), seconds, np.count_nonzero(Sj_vector > 0))
+            sys.stdout.flush()
+    finally:
+        for worker in workers.itervalues():
+            if worker.is_alive() and len(Sj_scores) + len(errors) < len(metrics):
+                worker.terminate()
+            worker.join()
+
+    if errors:
+        sys.exit('Error: %s' %'; '.join('%s failed (%s, see results/%s_%s.log)' %(METRIC.upper(), error, METRIC, ADVERSE_EVENT)
+                                         for METRIC, error in sorted(errors.iteritems())))
+    return Sj_scores, timings
+
+# Returns {metric: {protein_id: Sj}} for the requested metrics, running them
+# in separate processes when there is more than one
+def calc_Sj_scores(graph, ADVERSE_EVENT, metrics, processes=1, concurrent=True):
+    start = time.time()
+    if concurrent and len(metrics) > 1:
+        Sj_scores, timings = _run_concurrently(graph, ADVERSE_EVENT, metrics, processes)
+    else:
+        Sj_scores = dict()
+        timings = dict()
+        for METRIC in metrics:
+            print "\nRunning %s" %METRIC_NAMES[METRIC]
+            metric_start = time.time()
+            Sj_scores[METRIC] = calc_Sj(METRIC, graph, ADVERSE_EVENT, processes)
+            timings[METRIC] = time.time() - metric_start
+
+    if timings:
+        print "\nConnectivity function timings:"
+        for METRIC in metrics:
+            print "  %-5s %8.1fs" %(METRIC.upper(), timings[METRIC])
+        print "  %-5s %8.1fs" %('total', time.time() - start)
+    return Sj_scores
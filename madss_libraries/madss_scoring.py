@@ -22,8 +22,8 @@ For each connectivity function, it then assigns each drug the score of the
 most highly connected target as scored by the given connectivity function.
 These results are stored as a matrix in /scores.
 
-For any AE other than MI, a MySQL database of DrugBank will have to be
-set up to obtain drug targets.
+For any AE other than MI, drug targets are read from DrugBank, either a
+MySQL database or a local SQLite copy (see madss_drugbank.py).
 
 """
 
@@ -32,9 +32,10 @@ import sys
 import csv
 import numpy as np
 import scipy as sp
+from scipy import sparse
 import cPickle as pickle
 from collections import defaultdict
-import MySQLdb
+import madss_drugbank
 
 # Collect AE-specific drugs
 def open_gold_standard(ADVERSE_EVENT):
@@ -56,9 +57,10 @@ def open_gold_standard(ADVERSE_EVENT):
 
 
 # Gather DrugBank targets (e.g. targets, enzymes, transporters)
-def get_drugbank_targets(ADVERSE_EVENT, gt_drugs, node_list):
+def get_drugbank_targets(ADVERSE_EVENT, gt_drugs, node_index):
     # Initialize dictionaries
     drug_list = []
+    drug_list_seen = set()
     drugbank_targets = dict()
     drugbank2name = dict()
     ensembl2gene = dict()
@@ -67,8 +69,9 @@ def get_drugbank_targets(ADVERSE_EVENT, gt_drugs, node_list):
         drugbank_targets = pickle.load(open("stored_vals/drugbank_targets_%s.p" %ADVERSE_EVENT, "rb"))
         for drugbank_id in gt_drugs:
             if drugbank_id in drugbank_targets:
-                if not drugbank_id in drug_list:
+                if not drugbank_id in drug_list_seen:
                     drug_list.append(drugbank_id)
+                    drug_list_seen.add(drugbank_id)
 
         drugbank2name = pickle.load(open("stored_vals/drugbank2name_%s.p" %ADVERSE_EVENT, "rb"))
         ensembl2gene = pickle.load(open("stored_vals/ensembl2gene_%s.p" %ADVERSE_EVENT, "rb"))
@@ -76,146 +79,70 @@ def get_drugbank_targets(ADVERSE_EVENT, gt_drugs, node_list):
 
     except:
         print "Loading DrugBank targets from database"
-        dbConnection = MySQLdb.connect(read_default_file='~/.my.cnf', db = 'compound_drugbank03')
-        dbCursor = dbConnection.cursor()
-
-        SQL = 'select distinct drugbank_id,drugname from drug_categories order by drugname'
-        num_drugs = dbCursor.execute(SQL)
-        drug_results = dbCursor.fetchall()
-
-        for drugbank_id,drugname in drug_results:
-            if drugbank_id in gt_drugs:
-                if not drugbank_id in drug_list:
-                    drug_list.append(drugbank_id)
-                if not drugbank_id in drugbank_targets:
-                    drugbank_targets[drugbank_id] = set()
-                drugbank2name[drugbank_id] = drugname
+        drug_list, drugbank_targets, drugbank2name, ensembl2gene = madss_drugbank.get_targets(gt_drugs, node_index)
         print "%d drugs with targets loaded from DrugBank" %len(drug_list)
 
-        for i,drug in enumerate(drug_list):
-            percent_complete = float(i+1) / len(drug_list) * 100
-            print "%.2f" %percent_complete,
-            
-            # Targets
-            SQL = '''SELECT DISTINCT drug_allTargets_human.drugbank_id,idmapping.id, partner_protein.Gene_Name
-                     FROM compound_drugbank03.drug_allTargets_human,compound_drugbank03.partner_protein,protein_uniprot.idmapping
-                     WHERE idmapping.id_type = 'Ensembl_PRO'
-                     AND idmapping.uniprot = partner_protein.UniProt_ID
-                     AND partner_protein.Partner_ID = drug_allTargets_human.Target_Partner
-                     AND drug_allTargets_human.drugbank_id = '%s' ''' %drug
-            dbCursor.execute(SQL)
-            target_results = dbCursor.fetchall()
-            
-            for drugbank_id,target,name in target_results:
-                if target in node_list:
-                    drugbank_targets[drugbank_id].add(target)
-                    ensembl2gene[target] = name
-            
-            # Enzymes
-            SQL = '''SELECT DISTINCT drug_allEnzymes_human.drugbank_id,idmapping.id, partner_protein.Gene_Name
-                     FROM compound_drugbank03.drug_allEnzymes_human,compound_drugbank03.partner_protein,protein_uniprot.idmapping
-                     WHERE idmapping.id_type = 'Ensembl_PRO'
-                     AND idmapping.uniprot = partner_protein.UniProt_ID
-                     AND partner_protein.Partner_ID = drug_allEnzymes_human.Enzyme_Partner
-                     AND drug_allEnzymes_human.drugbank_id = '%s' ''' %drug
-            
-            dbCursor.execute(SQL)
-            enzyme_results = dbCursor.fetchall()
-            
-            for drugbank_id,enzyme,name in enzyme_results:
-                if enzyme in node_list:
-                    drugbank_targets[drugbank_id].add(enzyme)
-                    ensembl2gene[enzyme] = name
-            
-            # Transporters
-            SQL = '''SELECT DISTINCT drug_allTransporters_human.drugbank_id,idmapping.id, partner_protein.Gene_Name
-                     FROM compound_drugbank03.drug_allTransporters_human,compound_drugbank03.partner_protein,protein_uniprot.idmapping
-                     WHERE idmapping.id_type = 'Ensembl_PRO'
-                     AND idmapping.uniprot = partner_protein.UniProt_ID
-                     AND partner_protein.Partner_ID = drug_allTransporters_human.Transporter_Partner
-                     AND drug_allTransporters_human.drugbank_id = '%s' ''' %drug
-            
-            dbCursor.execute(SQL)
-            transporter_results = dbCursor.fetchall()
-            
-            for drugbank_id,transporter,name in transporter_results:
-                if transporter in node_list:
-                    drugbank_targets[drugbank_id].add(transporter)
-                    ensembl2gene[transporter] = name
-
-        dbCursor.close()
-        dbConnection.commit()
-        dbConnection.close()
-
         pickle.dump(drugbank_targets, open("stored_vals/drugbank_targets_%s.p" %ADVERSE_EVENT, "wb"))
         pickle.dump(drugbank2name, open("stored_vals/drugbank2name_%s.p" %ADVERSE_EVENT, "wb"))
         pickle.dump(ensembl2gene, open("stored_vals/ensembl2gene_%s.p" %ADVERSE_EVENT, "wb"))
-        print '\r'
 
     return drug_list, drugbank_targets, drugbank2name, ensembl2gene
 
 
-def find_best_target(Sj_list, drugbank_targets, drugbank2name, drugbank_id):
-    best_score = float()
-    best_target = ''
-
-    set_init_best = True    
-    
-    if drugbank_targets[drugbank_id] == set([]):
-        # print "\t",drugbank_id, drugbank2name[drugbank_id], "no targets found"
-        return 'x','x'
-    
-    for target in drugbank_targets[drugbank_id]:        
-        if set_init_best == True:
-            best_score = float(Sj_list[target])
-            best_target = target
-            set_init_best = False
-
-        if set_init_best == False:
-            if float(Sj_list[target]) > best_score:
-                best_score = float(Sj_list[target])
-                best_target = target
-    
-    return best_score,best_target
-
+# Sparse drug x protein incidence matrix with rows in drug_list order and
+# columns in node_index order. Within a row, targets keep the order of the
+# drug's target set, and ties resolve to the first of them.
+def drug_target_matrix(drug_list, drugbank_targets, node_index):
+    indptr = np.zeros(len(drug_list)+1, dtype=np.int64)
+    indices = []
+    for i, drugbank_id in enumerate(drug_list):
+        targets = [node_index[target] for target in drugbank_targets.get(drugbank_id, ()) if target in node_index]
+        indices += targets
+        indptr[i+1] = indptr[i] + len(targets)
+    data = np.ones(len(indices), dtype=np.int8)
+    return sparse.csr_matrix((data, np.array(indices, dtype=np.int64), indptr), shape=(len(drug_list), len(node_index)))
+
+# Best score of each drug's targets and the node id of that target, for each
+# column of Sj_matrix (nodes x metrics, or x phenotypes and metrics), by a
+# segmented max over the rows of the incidence matrix. NaN scores (e.g. BC of
+# the only seed) are passed over unless all of a drug's targets are NaN.
+# Drugs without targets get NaN and -1.
+def best_targets(incidence, Sj_matrix):
+    Sj_matrix = np.asarray(Sj_matrix, dtype=np.float64).reshape(incidence.shape[1], -1)
+    num_drugs = incidence.shape[0]
+    best_scores = np.empty((num_drugs, Sj_matrix.shape[1]))
+    best_scores.fill(np.nan)
+    best_nodes = np.empty((num_drugs, Sj_matrix.shape[1]), dtype=np.int64)
+    best_nodes.fill(-1)
+
+    has_targets = np.diff(incidence.indptr) > 0
+    if not has_targets.any():
+        return best_scores, best_nodes
+    starts = incidence.indptr[:-1][has_targets]
+    target_scores = Sj_matrix[incidence.indices]
+    segment_max = np.fmax.reduceat(target_scores, starts, axis=0)
+
+    # first target in each row reaching the row maximum
+    segment_ids = np.repeat(np.arange(len(starts)), np.diff(incidence.indptr)[has_targets])
+    positions = np.arange(len(incidence.indices))[:,np.newaxis]
+    row_max = segment_max[segment_ids]
+    is_max = (target_scores == row_max) | (np.isnan(target_scores) & np.isnan(row_max))
+    first_max = np.where(is_max, positions, len(incidence.indices))
+    first_max = np.minimum.reduceat(first_max, starts, axis=0)
+
+    best_scores[has_targets] = segment_max
+    best_nodes[has_targets] = incidence.indices[first_max]
+    return best_scores, best_nodes
 
 def score_drugs(ADVERSE_EVENT, drug_list, drugbank_targets, drugbank2name, ensembl2gene, id2gt, Sj_scores):
-    # Initialize score array
-    all_scores = np.array([['drugbank_id']])
-    for drugbank_id in drug_list:
-        all_scores = np.vstack((all_scores,drugbank_id))
-
-    # Add training labels
-    drug_labels = np.array([['causes_AE']])
-    for drugbank_id in all_scores[1:]:
-        drugbank_id = drugbank_id[0]
-        if drugbank_id in id2gt:
-            drug_labels = np.vstack((drug_labels,id2gt[drugbank_id]))
-        else:
-            drug_labels = np.vstack((drug_labels,''))
-    all_scores = np.hstack((all_scores,drug_labels))
-
-    # Iterate over each connectivity function
     METRICS = ['mfpt', 'bc', 'sn', 'isp']
-    for METRIC in METRICS:
-        print 'Scoring', METRIC.upper()
-        db_col = np.array([[METRIC.upper()]])
-        target_col = np.array(['%s Target' %METRIC.upper()])
-        
-        Sj_list = Sj_scores[METRIC]
-        
-        best_scores = dict()
-        best_targets = dict()
-
-        for drugbank_id in drug_list:
-            best_scores[drugbank_id], best_targets[drugbank_id] = find_best_target(Sj_list, drugbank_targets, drugbank2name, drugbank_id)
-            
-            db_col = np.vstack((db_col,str(best_scores[drugbank_id])))
-            temp_target = str(best_targets[drugbank_id])
-            target_col = np.vstack((target_col,ensembl2gene[temp_target] if temp_target in ensembl2gene else 'x'))
-        
-        all_scores = np.hstack((all_scores,db_col))
-        all_scores = np.hstack((all_scores,target_col))
+    node_names = sorted(Sj_scores[METRICS[0]])
+    node_index = dict((node, i) for i, node in enumerate(node_names))
+    Sj_matrix = np.array([[Sj_scores[METRIC][node] for METRIC in METRICS] for node in node_names])
+
+    print 'Scoring', ', '.join(METRIC.upper() for METRIC in METRICS)
+    incidence = drug_target_matrix(drug_list, drugbank_targets, node_index)
+    best_scores, best_nodes = best_targets(incidence, Sj_matrix)
 
     # Save results
     if not os.path.exists('scores'):
@@ -225,8 +152,13 @@ def score_drugs(ADVERSE_EVENT, drug_list, drugbank_targets, drugbank2name, ensem
     outf = open('scores/%s_drug_scores.csv' %(ADVERSE_EVENT),'w')
     writer = csv.writer(outf)
 
-    for drugbank_id,gt,mfpt,mtarget,bc,btarget,sn,starget,isp,itarget in all_scores:
-        if mfpt != 'x':
-            writer.writerow([drugbank2name[drugbank_id] if drugbank_id in drugbank2name else "drug_name",drugbank_id,gt,mfpt,mtarget,bc,btarget,sn,starget,isp,itarget])
-          
-    outf.close()
\ No newline at end of file
+    writer.writerow(['drug_name', 'drugbank_id', 'causes_AE'] + sum([[METRIC.upper(), '%s Target' %METRIC.upper()] for METRIC in METRICS], []))
+    for i, drugbank_id in enumerate(drug_list):
+        if best_nodes[i,0] < 0:
+            continue
+        row = [drugbank2name[drugbank_id] if drugbank_id in drugbank2name else "drug_name", drugbank_id, id2gt.get(drugbank_id, '')]
+        for k in xrange(len(METRICS)):
+            row += [str(float(best_scores[i,k])), ensembl2gene.get(node_names[best_nodes[i,k]], 'x')]
+        writer.writerow(row)
+
+    outf.close()
@@ -0,0 +1,49 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Seed sets for each phenotype. PHENOTYPE_SEEDS holds the seeds curated for
+the paper; read_seed_file reads further seed sets from a text file with one
+phenotype per line followed by its seed ENSP ids, separated by tabs or commas,
+for example:
+MI	ENSP00000358301	ENSP00000206249	ENSP00000366307
+Lines starting with # are ignored, and a phenotype listed on several lines
+gets the union of their seeds.
+
+"""
+
+import re
+from collections import OrderedDict
+
+PHENOTYPE_SEEDS = OrderedDict([
+    ('MI', ['ENSP00000358301','ENSP00000206249','ENSP00000366307','ENSP00000304236','ENSP00000287936','ENSP00000290866','ENSP00000392858','ENSP00000361125','ENSP00000258743','ENSP00000229135']),
+    ('Gastro', ['ENSP00000287641','ENSP00000356438','ENSP00000366506','ENSP00000334145','ENSP00000354612','ENSP00000308541','ENSP00000218099','ENSP00000039007']),
+    ('Liver', ['ENSP00000258743','ENSP00000295897','ENSP00000263341','ENSP00000308541','ENSP00000264708','ENSP00000356438','ENSP00000206249','ENSP00000412237','ENSP00000353483','ENSP00000356771','ENSP00000334145','ENSP00000351671','ENSP00000356694','ENSP00000216117','ENSP00000253408']),
+    ('Kidney', ['ENSP00000360997', 'ENSP00000295897', 'ENSP00000265132', 'ENSP00000340858', 'ENSP00000379204', 'ENSP00000328173', 'ENSP00000241052', 'ENSP00000356399', 'ENSP00000265689', 'ENSP00000384400', 'ENSP00000360541', 'ENSP00000366124', 'ENSP00000377192', 'ENSP00000378408', 'ENSP00000338082', 'ENSP00000222390', 'ENSP00000287936', 'ENSP00000348170', 'ENSP00000298556', 'ENSP00000280357', 'ENSP00000265023', 'ENSP00000277480', 'ENSP00000229794', 'ENSP00000352835', 'ENSP00000365663', 'ENSP00000355759', 'ENSP00000265970', 'ENSP00000364252', 'ENSP00000234347', 'ENSP00000164139', 'ENSP00000360519', 'ENSP00000272190', 'ENSP00000367102', 'ENSP00000264938', 'ENSP00000368727']),
+    ('LQTS', ['ENSP00000262186','ENSP00000155840','ENSP00000337255','ENSP00000290310','ENSP00000266483','ENSP00000348573','ENSP00000217381','ENSP00000328968','ENSP00000243457','ENSP00000266376','ENSP00000341940','ENSP00000349588','ENSP00000322460']),
+])
+
+def read_seed_file(path):
+    seed_sets = OrderedDict()
+    for line in open(path, 'rU'):
+        if not line.strip() or line.startswith('#'):
+            continue
+        newline = [field.strip() for field in re.split('\t|,', line.strip())]
+        phenotype, seeds = newline[0], [seed for seed in newline[1:] if seed]
+        seed_sets.setdefault(phenotype, [])
+        seed_sets[phenotype] += [seed for seed in seeds if seed not in seed_sets[phenotype]]
+    return seed_sets
@@ -0,0 +1,193 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Long-running local scoring service. Loads the interactome and the
+seed-independent aggregates once, then answers seed-set queries over HTTP
+on localhost or on a Unix socket. Start from the MADSS folder with:
+python madss_libraries/madss_server.py [--port=8765 | --socket=PATH] [--processes=N]
+
+GET  /status   interactome size and fingerprint
+POST /score    JSON body {"seeds": [ENSP ids],
+                          "adverse_event": "MI",         (optional)
+                          "drug_targets": {id: [ENSP]},  (optional)
+                          "top": 100}                    (optional)
+               Returns the Sj of every node (or of the top-scoring nodes)
+               for each connectivity function and, if an adverse event or
+               drug targets are given, each drug's best score and target.
+
+"""
+
+import os
+import sys
+import json
+import time
+import SocketServer
+import BaseHTTPServer
+import numpy as np
+import madss_interactome
+import madss_cache
+import madss_engine
+import madss_scoring
+
+# Description of what is wrong with a /score query, or None if its fields
+# have the expected types
+def query_error(query):
+    if not isinstance(query, dict) or 'seeds' not in query:
+        return 'expected a JSON body with a "seeds" list'
+    if not isinstance(query['seeds'], list) or not all(isinstance(seed, basestring) for seed in query['seeds']):
+        return '"seeds" must be a list of ENSP id strings'
+    top = query.get('top')
+    if top is not None and (isinstance(top, bool) or not isinstance(top, (int, long)) or top < 0):
+        return '"top" must be a non-negative integer'
+    if 'adverse_event' in query and not isinstance(query['adverse_event'], basestring):
+        return '"adverse_event" must be a string'
+    if 'drug_targets' in query:
+        drug_targets = query['drug_targets']
+        if not isinstance(drug_targets, dict) or not all(isinstance(targets, list) and all(isinstance(t, basestring) for t in targets)
+                                                         for targets in drug_targets.itervalues()):
+            return '"drug_targets" must map each drug id to a list of ENSP id strings'
+    return None
+
+class ScoringHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # set by serve()
+    graph = None
+    aggregates = None
+    drug_targets = dict()
+
+    def _reply(self, code, body):
+        payload = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        sys.stderr.write("%s %s\n" %(time.strftime('%Y-%m-%d %H:%M:%S'), format %args))
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self._reply(404, {'error': 'unknown path %s' %self.path})
+        self._reply(200, {'nodes': self.graph.num_nodes,
+                          'edges': self.graph.num_edges,
+                          'fingerprint': madss_cache.graph_fingerprint(self.graph)})
+
+    def do_POST(self):
+        if self.path != '/score':
+            return self._reply(404, {'error': 'unknown path %s' %self.path})
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+        except ValueError:
+            return self._reply(400, {'error': 'expected a JSON body with a "seeds" list'})
+        error = query_error(query)
+        if error:
+            return self._reply(400, {'error': error})
+        seeds = [str(seed) for seed in query['seeds']]
+        if not any(seed in self.graph.index for seed in seeds):
+            return self._reply(400, {'error': 'none of the seeds are in the interactome'})
+        try:
+            self._reply(200, self.score(query, seeds))
+        except Exception, e:
+            self._reply(500, {'error': str(e)})
+
+    def score(self, query, seeds):
+        start = time.time()
+        graph, Sj_vectors = madss_engine.score_seeds(self.graph, self.aggregates, seeds)
+
+        response = {'seeds_used': [seed for seed in seeds if seed in graph.index],
+                    'seeds_missing': [seed for seed in seeds if seed not in graph.index],
+                    'neighborhood_size': dict((METRIC, int(np.count_nonzero(Sj > 0))) for METRIC, Sj in Sj_vectors.iteritems()),
+                    'Sj': dict()}
+        top = query.get('top')
+        for METRIC, Sj in Sj_vectors.iteritems():
+            order = np.argsort(-Sj)[:top] if top else np.arange(graph.num_nodes)
+            response['Sj'][METRIC] = [[graph.names[i], float(Sj[i])] for i in order]
+
+        targets = self.targets_for(query)
+        if targets is not None:
+            drug_list, drugbank_targets, drugbank2name, ensembl2gene = targets
+            incidence = madss_scoring.drug_target_matrix(drug_list, drugbank_targets, graph.index)
+            Sj_matrix = np.column_stack([Sj_vectors[METRIC] for METRIC in madss_engine.METRICS])
+            best_scores, best_nodes = madss_scoring.best_targets(incidence, Sj_matrix)
+            drug_scores = []
+            for i, drugbank_id in enumerate(drug_list):
+                row = {'drugbank_id': drugbank_id, 'drug_name': drugbank2name.get(drugbank_id, 'drug_name')}
+                for k, METRIC in enumerate(madss_engine.METRICS):
+                    if best_nodes[i,k] < 0:
+                        row[METRIC] = row[METRIC + '_target'] = None
+                        continue
+                    best_target = graph.names[best_nodes[i,k]]
+                    row[METRIC] = float(best_scores[i,k])
+                    row[METRIC + '_target'] = ensembl2gene.get(best_target, best_target)
+                drug_scores.append(row)
+            response['drug_scores'] = drug_scores
+
+        response['seconds'] = time.time() - start
+        return response
+
+    # (drug_list, drugbank_targets, drugbank2name, ensembl2gene) for the query,
+    # with the targets of each adverse event loaded once per server
+    def targets_for(self, query):
+        if 'drug_targets' in query:
+            drugbank_targets = dict((str(drug), set(str(t) for t in targets if t in self.graph.index))
+                                    for drug, targets in query['drug_targets'].iteritems())
+            return sorted(drugbank_targets), drugbank_targets, dict(), dict()
+        if 'adverse_event' in query:
+            ADVERSE_EVENT = str(query['adverse_event'])
+            if ADVERSE_EVENT not in self.drug_targets:
+                gt_drugs, id2gt = madss_scoring.open_gold_standard(ADVERSE_EVENT)
+                self.drug_targets[ADVERSE_EVENT] = madss_scoring.get_drugbank_targets(ADVERSE_EVENT, gt_drugs, self.graph.index)
+            return self.drug_targets[ADVERSE_EVENT]
+        return None
+
+class UnixHTTPServer(SocketServer.UnixStreamServer):
+    def get_request(self):
+        request, client_address = SocketServer.UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('unix', 0)
+
+def serve(port=8765, socket_path=None, processes=1):
+    graph = madss_interactome.load_network()
+    print "Loading seed-independent aggregates"
+    ScoringHandler.graph = graph
+    ScoringHandler.aggregates = madss_engine.load_aggregates(graph, processes)
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ScoringHandler)
+        print "Serving on unix socket %s" %socket_path
+    else:
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), ScoringHandler)
+        print "Serving on http://127.0.0.1:%d" %port
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    serve(port=int(options.get('port', 8765)),
+          socket_path=options.get('socket'),
+          processes=int(options.get('processes', 1)) or None)
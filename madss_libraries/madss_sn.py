@@ -23,136 +23,98 @@ Script to compute adapted shared neighbors connectivity function.
 import os
 import sys
 import numpy as np
-import networkx as nx
-import cPickle as pickle
-
-def restart_line():
-    sys.stdout.write('\r')
-    sys.stdout.flush()
+from scipy import sparse
+import madss_cache
+import madss_results
 
 #----------------------------------------------------------------------------------------
-
-def calc_Tc(H,i,j,neighbors):
-    Tc = 0
-    
-    n_i = neighbors[i]
-    n_j = neighbors[j]
-    
-    set_union = n_i | n_j         # union
-
-    set_intersection = n_i & n_j  # intersection
-    
-    Tc = len(set_intersection) / float(len(set_union))
-    
-    return Tc
+# Sparse Jaccard engine. For i != j, the shared-neighbor count is (A*A)[i,j]
+# and the union size is deg(i) + deg(j) - (A*A)[i,j]; Tc is zero for any pair
+# more than two hops apart, so only the nonzeros of A*A contribute.
+
+# Tc between each node in sources and every other node, as a sparse
+# len(sources) x N matrix (the entry for a source and itself is left out)
+def calc_Tc_rows(graph, sources, A=None):
+    if A is None:
+        A = graph.adjacency()
+    sources = np.asarray(sources, dtype=np.int32)
+    degree = graph.degree.astype(float)
+
+    shared = (A[sources] * A).tocoo()
+    off_diagonal = sources[shared.row] != shared.col
+    rows = shared.row[off_diagonal]
+    cols = shared.col[off_diagonal]
+    intersection = shared.data[off_diagonal]
+
+    Tc = intersection / (degree[sources[rows]] + degree[cols] - intersection)
+    return sparse.csr_matrix((Tc, (rows, cols)), shape=(len(sources), graph.num_nodes))
+
+# Tc_all[j] = sum over i != j of Tc(i,j); the product is formed for blocks of
+# rows to bound memory around hubs
+def calc_Tc_alls(graph, block_size=2048):
+    numNodes = graph.num_nodes
+    A = graph.adjacency()
+    Tc_alls = np.zeros(numNodes)
+
+    for start in xrange(0, numNodes, block_size):
+        stop = min(start + block_size, numNodes)
+        Tc_alls[start:stop] = np.asarray(calc_Tc_rows(graph, np.arange(start, stop), A).sum(1)).ravel()
+
+    return Tc_alls
+
+# Sum of Tc(i,j) over seeds i != j for every node j, from the seed rows of A*A
+def calc_Tc_seeds(graph, seeds_left):
+    return np.asarray(calc_Tc_rows(graph, seeds_left).sum(0)).ravel()
 
 #----------------------------------------------------------------------------------------
 
-def calc_Sj_stored(H,j,seeds_left,Tc_alls, neighbors, complement):
-    Tc_seeds = 0
-    #Tc_comp  = 0
-    Tc_all   = Tc_alls[j]
-    
-    for i in seeds_left:
-        Tc_temp = 0
-        if i != j:
-            Tc_temp = calc_Tc(H,i,j,neighbors)
-            Tc_seeds += Tc_temp
-    Tc_comp = Tc_all - Tc_seeds
+# Sj for all nodes at once from the seed and all-node Tc sums. For many seed
+# sets at once, pass N x P seed sums, Tc_alls as an N x 1 column and P seed
+# and complement counts.
+def calc_Sj_stored(Tc_seeds,Tc_alls,numSeeds,numComplement):
+    Tc_comp = Tc_alls - Tc_seeds
     
-    numSeeds = Tc_seeds / float(len(seeds_left))
+    inSeeds = Tc_seeds / np.asarray(numSeeds, dtype=float)
     
-    numComp = Tc_comp / float(len(complement))
+    numComp = Tc_comp / np.asarray(numComplement, dtype=float)
     
-    denominator = Tc_all / float(len(H))
+    denominator = Tc_alls / float(len(Tc_alls))
     
-    Sj = (numSeeds - numComp) / float(denominator)
+    Sj = (inSeeds - numComp) / denominator
     
     return Sj
 #----------------------------------------------------------------------------------------
 
 
-def calc_sn_Sj(ppi, node_list, H, ADVERSE_EVENT, seeds):
-    seeds_left = []
-    for node in node_list:
-        for seed in seeds:
-            if node == seed:
-                if not node in seeds_left:
-                    seeds_left.append(node)
-    # print "Number of seeds left:",len(seeds_left)
-
-    complement = []
-    for node in node_list:
-        if not node in seeds_left:
-            if not node in complement:
-                complement.append(node)
-
-    # Try to load stored neighbors and Tcs
-    try:
-        neighbors = pickle.load(open("stored_vals/string700_neighbors.p", "rb") )
-        Tc_alls = pickle.load(open("stored_vals/string700_Tc_alls.p" , "rb") )
-        print "stored values loaded"
-
-    except:
-        #### Build neighbor dictionary
-        print "building neighbor dictionary...",
-        sys.stdout.flush()
-
-        neighbors = dict()
-        for node in H:
-            neighbors[node] = set(nx.all_neighbors(H,node))
-        pickle.dump(neighbors, open("stored_vals/string700_neighbors.p" , "wb"))
-        print "done"
-        sys.stdout.flush()
-
-        #### Calculate Tc_all
+# Loads stored Tcs, building them on a cache miss
+def load_Tc_alls(graph):
+    def build_Tc_alls():
         print "building Tc_all dictionary...",
         sys.stdout.flush()
-        Tc_alls = dict()
-
-        node_count = 0
-        for j in H:
-            Tc_all = 0
-
-            for i in H:
-                Tc_temp = 0
-                if i != j:
-                    Tc_temp = calc_Tc(H,i,j,neighbors)
-                    Tc_all += Tc_temp
-            
-            Tc_alls[j] = Tc_all
-            
-            node_count += 1
-            if node_count % 500 == 0:
-                print node_count,
-                sys.stdout.flush()
-        pickle.dump(Tc_alls, open("stored_vals/string700_Tc_alls.p" , "wb"))
+        Tc_alls = calc_Tc_alls(graph)
         print 'done',len(Tc_alls),'\n'
-    ####
+        return Tc_alls
 
-    Sj_dict = dict()
+    return madss_cache.cached(graph, 'Tc_alls', 1, build_Tc_alls,
+                              legacy=lambda: madss_cache.legacy_pickle(graph, "stored_vals/string700_Tc_alls.p"))
 
-    #----- Calc Sj ---------
-    for i, j in enumerate(H):
-        sys.stdout.write('Calculating Sj for node: %s (Index %d): ' %(j,i)),
+def calc_sn_Sj(graph, ADVERSE_EVENT):
+    numNodes = graph.num_nodes
+    seeds_left = graph.seed_ids().tolist()
+    numComplement = np.count_nonzero(graph.comp_mask)
 
-        Sj_dict[j] = calc_Sj_stored(H,j,seeds_left,Tc_alls, neighbors, complement)
-        
-        sys.stdout.write('%s' %Sj_dict[j])
-        sys.stdout.flush()
-        restart_line()
+    Tc_alls = load_Tc_alls(graph)
+    print "stored values loaded"
 
-    Sj_file = open('results/sn_Sj_%s.txt' %ADVERSE_EVENT, 'w')
-    neighborhood = []
+    #----- Calc Sj ---------
+    print "Calculating Sj...",
+    sys.stdout.flush()
+    Tc_seeds = calc_Tc_seeds(graph, seeds_left)
+    Sj_vector = calc_Sj_stored(Tc_seeds, Tc_alls, len(seeds_left), numComplement)
+    print 'done'
 
-    for j in H:
-        Sj_file.write("%s\t%s\n" %(Sj_dict[j],j))
-        if Sj_dict[j] > 0:
-            if not j in neighborhood:
-                neighborhood.append(j)
+    Sj_dict = madss_results.write_Sj_file('sn', ADVERSE_EVENT, graph, Sj_vector)
 
-    #print "Number of Sj values:",len(Sj_dict)
-    print "\nNeighborhood size:",len(neighborhood)
+    print "\nNeighborhood size:",np.count_nonzero(Sj_vector > 0)
 
-    Sj_file.close()
     return Sj_dict
@@ -0,0 +1,214 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Run telemetry: rate-limited progress lines, timed spans, events and a JSON
+run report.
+- progress() rewrites one console line at most every PROGRESS_INTERVAL
+  seconds (and always for the last item), instead of on every node.
+- span() times a stage, recording its wall time, CPU time (its own and that
+  of finished child processes) and the process's peak and current RSS.
+- event() records a point event, such as a cache hit or miss (see
+  madss_cache.py).
+- write_report() saves the spans and events of a run as JSON, typically as
+  results/<AE>_run_report.json.
+Forked workers start from a copy of the parent's records; a worker calls
+reset() and sends snapshot() back, and the parent adds it with merge().
+set_silent() (or MADSS_SILENT=1 in the environment) sends all console output
+to /dev/null for batch jobs; telemetry is still recorded and reported.
+
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+PROGRESS_INTERVAL = float(os.environ.get('MADSS_PROGRESS_INTERVAL', 1.0))
+SILENT = False
+
+_records = {'started': time.time(), 'spans': [], 'events': []}
+_open_spans = []
+_last_progress = dict()
+_console = None
+
+#----------------------------------------------------------------------------------------
+# Console output
+
+def set_silent(silent=True):
+    global SILENT, _console
+    SILENT = silent
+    if silent and _console is None:
+        _console = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+    elif not silent and _console is not None:
+        sys.stdout.close()
+        sys.stdout = _console
+        _console = None
+
+# Shows "label: done/total" (or "label: done" without a total) on a line that
+# is rewritten in place. The line is ended once done reaches total, or by a
+# call with final=True after the loop, which shows the last count and is a
+# no-op if the line was already ended
+def progress(label, done, total=None, final=False):
+    if SILENT:
+        return
+    if final and label not in _last_progress:
+        return
+    finished = final or (total is not None and done >= total)
+    now = time.time()
+    if not finished and now - _last_progress.get(label, 0) < PROGRESS_INTERVAL:
+        return
+    if finished:
+        _last_progress.pop(label, None)
+        sys.stdout.write('%s: %d/%d\n' %(label, done, total) if total is not None else '%s: %d\n' %(label, done))
+    else:
+        _last_progress[label] = now
+        sys.stdout.write('%s: %d/%d\r' %(label, done, total) if total is not None else '%s: %d\r' %(label, done))
+    sys.stdout.flush()
+
+#----------------------------------------------------------------------------------------
+# Resource figures
+
+def _cpu_seconds():
+    times = os.times()
+    return times[0] + times[1], times[2] + times[3]
+
+def _proc_status_mb(field):
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return None
+
+# Peak RSS of this process in MB
+def peak_rss_mb():
+    peak = _proc_status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    # ru_maxrss is in kB on Linux and in bytes on OS X
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024.0**2 if sys.platform == 'darwin' else 1024.0)
+
+# Current RSS of this process in MB, or None where /proc is not available
+def rss_mb():
+    return _proc_status_mb('VmRSS')
+
+# Resets the peak RSS of this process; False if the kernel does not support it
+def reset_peak_rss():
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        f.write('5')
+        f.close()
+        return True
+    except IOError:
+        return False
+
+#----------------------------------------------------------------------------------------
+# Spans and events
+
+# Times the enclosed block as a span called name; attributes are stored with
+# it, and the yielded record can be given more while the block runs
+@contextmanager
+def span(name, **attributes):
+    record = dict(attributes)
+    record['name'] = name
+    record['parent'] = _open_spans[-1] if _open_spans else None
+    record['start'] = time.time()
+    cpu, children_cpu = _cpu_seconds()
+    _open_spans.append(name)
+    try:
+        yield record
+        record['status'] = 'ok'
+    except BaseException:
+        record['status'] = 'error'
+        raise
+    finally:
+        _open_spans.pop()
+        end_cpu, end_children_cpu = _cpu_seconds()
+        record['wall_s'] = round(time.time() - record['start'], 4)
+        record['cpu_s'] = round(end_cpu - cpu, 4)
+        record['children_cpu_s'] = round(end_children_cpu - children_cpu, 4)
+        record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        record['rss_mb'] = rss_mb()
+        _records['spans'].append(record)
+
+def event(kind, **fields):
+    fields['kind'] = kind
+    fields['time'] = time.time()
+    _records['events'].append(fields)
+
+#----------------------------------------------------------------------------------------
+# Records of forked workers
+
+def reset():
+    del _records['spans'][:]
+    del _records['events'][:]
+    del _open_spans[:]
+    _records['started'] = time.time()
+
+def snapshot():
+    return {'spans': list(_records['spans']), 'events': list(_records['events'])}
+
+# Adds a worker's snapshot, tagging its records with attributes (e.g. the
+# metric the worker ran)
+def merge(records, **attributes):
+    for kind in ('spans', 'events'):
+        for record in records[kind]:
+            record.update(attributes)
+            _records[kind].append(record)
+
+# Number of spans and events so far, to report only the records after it
+def mark():
+    return len(_records['spans']), len(_records['events'])
+
+#----------------------------------------------------------------------------------------
+
+def write_report(path, since=(0, 0), **metadata):
+    spans = _records['spans'][since[0]:]
+    events = _records['events'][since[1]:]
+    cache = dict()
+    for record in events:
+        if record['kind'] == 'cache':
+            cache[record['result']] = cache.get(record['result'], 0) + 1
+    cpu, children_cpu = _cpu_seconds()
+    report = {'started': _records['started'],
+              'finished': time.time(),
+              'argv': sys.argv,
+              'pid': os.getpid(),
+              'cpu_s': round(cpu, 4),
+              'children_cpu_s': round(children_cpu, 4),
+              'peak_rss_mb': round(peak_rss_mb(), 1),
+              'metadata': metadata,
+              'cache': cache,
+              'spans': sorted(spans, key=lambda record: record['start']),
+              'events': events}
+    if not os.path.exists(os.path.dirname(path) or '.'):
+        os.makedirs(os.path.dirname(path))
+    tmp_path = '%s.%d.tmp' %(path, os.getpid())
+    f = open(tmp_path, 'w')
+    json.dump(report, f, indent=1, sort_keys=True)
+    f.close()
+    os.rename(tmp_path, path)
+    return report
+
+if os.environ.get('MADSS_SILENT', '') not in ('', '0'):
+    set_silent(True)
@@ -0,0 +1,205 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Applies an edge diff to the binary interactome and patches the cached
+seed-independent aggregates of the old interactome into entries for the new
+one, recomputing only the parts the changed edges can affect:
+- SN: Tc changes only for pairs involving an endpoint of a changed edge, so
+  the Tc rows of the endpoints are recomputed in both graphs.
+- ISP and BC: a source is recomputed only if a changed edge alters its BFS
+  distances (ISP) or its shortest-path DAG (BC). Distances from the
+  endpoints in the old graph tell which sources those are.
+- MFPT: every edge change is a rank-one change of the grounded Laplacian, so
+  the cached diagonal of its inverse is updated with the Woodbury identity
+  from solves with the old factorization.
+Aggregates that were not cached for the old interactome are left to be built
+on first use. If the change alters which proteins are in the largest
+connected island, there is nothing to patch and all of them are rebuilt.
+
+The diff lists one edge per line, "+" to add it or "-" to remove it:
++	ENSP00000358301	ENSP00000206249
+-	ENSP00000366307	ENSP00000304236
+Run from the MADSS folder:
+python madss_libraries/madss_update.py edges.diff [--interactome=string700_data.npz] [--processes=N]
+
+"""
+
+import os
+import re
+import sys
+import time
+import numpy as np
+import madss_interactome
+import madss_cache
+import madss_mfpt
+import madss_bc
+import madss_sn
+import madss_isp
+
+def read_edge_diff(path):
+    added = []
+    removed = []
+    for line in open(path, 'rU'):
+        if not line.strip() or line.startswith('#'):
+            continue
+        newline = re.split('[\t ,]+', line.strip())
+        if len(newline) != 3 or newline[0] not in ('+', '-'):
+            raise ValueError('Bad edge diff line (expected "+/-  protein1  protein2"): %s' %line.strip())
+        (added if newline[0] == '+' else removed).append((newline[1], newline[2]))
+    return added, removed
+
+# New binary interactome arrays with the edges added and removed, and the
+# (protein1, protein2, +1 or -1) edge changes that actually took effect. The
+# record of the source edge list is kept, so the edited interactome is not
+# converted again from an unchanged pickle.
+def apply_edge_diff(arrays, added, removed):
+    names = arrays['names']
+    edges = set(tuple(sorted((names[a], names[b]))) for a, b in arrays['edges'])
+
+    changes = []
+    for a, b in removed:
+        edge = tuple(sorted((a, b)))
+        if edge in edges:
+            edges.remove(edge)
+            changes.append(edge + (-1,))
+    for a, b in added:
+        edge = tuple(sorted((a, b)))
+        if a != b and edge not in edges:
+            edges.add(edge)
+            changes.append(edge + (1,))
+    source = None
+    if 'source_sha1' in arrays.files:
+        source = dict((key, arrays[key]) for key in ('source_size', 'source_mtime', 'source_sha1'))
+    return madss_interactome.convert_edge_list(sorted(edges), source), changes
+
+# Sources whose BFS distances (isp) or shortest-path DAGs (bc) differ between
+# the graphs. With d the old distances, removing an edge (u,v) changes both
+# for sources with |d(s,u) - d(s,v)| = 1 (the edge is on their DAG); adding
+# it changes the DAG for sources with a difference of 1 or more and the
+# distances for a difference of 2 or more.
+def affected_sources(old_graph, edge_ids):
+    endpoints = np.unique(edge_ids[:,:2])
+    dist = dict((u, madss_interactome.bfs_distances(old_graph, u)) for u in endpoints)
+    isp_affected = np.zeros(old_graph.num_nodes, dtype=bool)
+    bc_affected = np.zeros(old_graph.num_nodes, dtype=bool)
+    for u, v, sign in edge_ids:
+        difference = np.abs(dist[u] - dist[v])
+        if sign < 0:
+            isp_affected |= difference == 1
+            bc_affected |= difference == 1
+        else:
+            isp_affected |= difference >= 2
+            bc_affected |= difference >= 1
+    return np.flatnonzero(isp_affected), np.flatnonzero(bc_affected)
+
+# Tc_all[j] sums Tc over pairs (i,j); only pairs with an endpoint in
+# endpoints change. For j outside endpoints these are the endpoint rows'
+# column sums, for j among them the full row of j.
+def _endpoint_Tc_sums(graph, endpoints):
+    rows = madss_sn.calc_Tc_rows(graph, endpoints)
+    sums = np.asarray(rows.sum(0)).ravel()
+    sums[endpoints] = np.asarray(rows.sum(1)).ravel()
+    return sums
+
+def update_Tc_alls(old_graph, new_graph, Tc_alls, endpoints):
+    return Tc_alls - _endpoint_Tc_sums(old_graph, endpoints) + _endpoint_Tc_sums(new_graph, endpoints)
+
+def update_isp_alls(new_graph, isp_alls, sources):
+    isp_alls = np.array(isp_alls)
+    isp_alls[sources] = madss_isp.harmonic_sums(new_graph, sources)
+    return isp_alls
+
+# Each affected source costs two passes (old and new graph), so past half of
+# the nodes a full recomputation on the new graph is cheaper
+def update_centralities(old_graph, new_graph, centralities, sources, processes=1):
+    if not len(sources):
+        return np.array(centralities)
+    if 2 * len(sources) > new_graph.num_nodes:
+        return madss_bc.sub_betweenness_centrality(new_graph, range(new_graph.num_nodes), processes)
+    return (centralities - madss_bc.sub_betweenness_centrality(old_graph, sources.tolist(), processes)
+                         + madss_bc.sub_betweenness_centrality(new_graph, sources.tolist(), processes))
+
+# diag of the grounded inverse after adding (sign +1) or removing (-1) edges:
+# L' = L + U W U' with the columns of U being e_u - e_v, so
+# G' = G - (G U) inv(inv(W) + U' G U) (G U)'
+def update_grounded_diag(old_graph, G_diag, edge_ids):
+    solve, degree = madss_mfpt._grounded_solver(old_graph.adjacency())
+    U = np.zeros((old_graph.num_nodes, len(edge_ids)))
+    U[edge_ids[:,0], np.arange(len(edge_ids))] = 1.0
+    U[edge_ids[:,1], np.arange(len(edge_ids))] = -1.0
+    GU = solve(U)
+    capacitance = np.diag(1.0 / edge_ids[:,2]) + U.T.dot(GU)
+    return G_diag - (GU * np.linalg.solve(capacitance, GU.T).T).sum(1)
+
+def update_interactome(diff_path, binary_file="string700_data.npz", processes=1):
+    old_graph = madss_interactome.load_binary_network(binary_file)
+    added, removed = read_edge_diff(diff_path)
+    arrays, changes = apply_edge_diff(np.load(binary_file), added, removed)
+    print "%d edges added and %d removed (%d changes in the diff had no effect)" %(
+        sum(1 for change in changes if change[2] > 0), sum(1 for change in changes if change[2] < 0),
+        len(added) + len(removed) - len(changes))
+    if not changes:
+        return
+
+    madss_interactome.save_binary_network(arrays, binary_file)
+    new_graph = madss_interactome.load_binary_network(binary_file)
+    print "Interactome saved to %s (%d nodes, %d edges)" %(binary_file, new_graph.num_nodes, new_graph.num_edges)
+
+    if new_graph.names != old_graph.names:
+        print "The largest connected island changed; cached values will be rebuilt on first use"
+        return
+    edge_ids = np.array([(old_graph.index[a], old_graph.index[b], sign) for a, b, sign in changes
+                         if a in old_graph.index and b in old_graph.index], dtype=np.int64).reshape(-1, 3)
+    if not len(edge_ids):
+        return
+    endpoints = np.unique(edge_ids[:,:2])
+
+    start = time.time()
+    isp_sources, bc_sources = affected_sources(old_graph, edge_ids)
+
+    Tc_alls = madss_cache.load(old_graph, 'Tc_alls', 1)
+    if Tc_alls is not None:
+        madss_cache.store(new_graph, 'Tc_alls', 1, update_Tc_alls(old_graph, new_graph, Tc_alls, endpoints))
+        print "SN: Tc sums updated from the rows of %d endpoints" %len(endpoints)
+
+    isp_alls = madss_cache.load(old_graph, 'isp_alls', 1)
+    if isp_alls is not None:
+        madss_cache.store(new_graph, 'isp_alls', 1, update_isp_alls(new_graph, isp_alls, isp_sources))
+        print "ISP: %d of %d sources recomputed" %(len(isp_sources), new_graph.num_nodes)
+
+    centralities = madss_cache.load(old_graph, 'centralities_no_rescale', 1)
+    if centralities is not None:
+        madss_cache.store(new_graph, 'centralities_no_rescale', 1,
+                          update_centralities(old_graph, new_graph, centralities, bc_sources, processes))
+        print "BC: %d of %d sources recomputed" %(len(bc_sources), new_graph.num_nodes)
+
+    G_diag = madss_cache.load(old_graph, 'mfpt_grounded_diag', 1)
+    if G_diag is not None:
+        madss_cache.store(new_graph, 'mfpt_grounded_diag', 1, update_grounded_diag(old_graph, G_diag, edge_ids))
+        print "MFPT: grounded inverse diagonal updated for %d edge changes" %len(edge_ids)
+
+    print "Cached values updated in %.1fs" %(time.time() - start)
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    diff_files = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(diff_files) != 1:
+        sys.exit('Usage: python madss_libraries/madss_update.py edges.diff [--interactome=string700_data.npz] [--processes=1]')
+    update_interactome(diff_files[0], options.get('interactome', "string700_data.npz"),
+                       int(options.get('processes', 1)) or None)
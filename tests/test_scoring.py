@@ -0,0 +1,59 @@
+"""
+MADSS v1.1, Updated December 7, 2015
+Citation:
+Lorberbaum, T., Nasir, M., Keiser, M., Vilar, S., Hripcsak, G. and Tatonetti, N. (2015),
+Systems Pharmacology Augments Drug Safety Surveillance. Clinical Pharmacology & Therapeutics,
+97: 151-158. doi: 10.1002/cpt.2
+http://onlinelibrary.wiley.com/doi/10.1002/cpt.2/abstract
+
+Copyright (C) 2014-2015, Tatonetti Lab
+Tal Lorberbaum <tal.lorberbaum@columbia.edu>
+Nicholas P. Tatonetti <nick.tatonetti@columbia.edu>
+All rights reserved.
+
+This script is part of MADSS which is released under a CC BY-NC-SA 4.0 license.
+For full license details see LICENSE.txt or go to:
+http://creativecommons.org/licenses/by-nc-sa/4.0/
+
+------------------------------------------------------------------------
+Checks of the segmented best-target search in madss_scoring.py. Run from
+the MADSS folder with:
+python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'madss_libraries'))
+import madss_scoring
+
+nan = float('nan')
+
+class BestTargetsTest(unittest.TestCase):
+    def setUp(self):
+        node_index = {'A': 0, 'B': 1, 'C': 2}
+        drugbank_targets = {'DB1': ['A', 'B', 'C'], 'DB2': ['A'], 'DB3': ['C', 'B'], 'DB4': []}
+        self.incidence = madss_scoring.drug_target_matrix(['DB1', 'DB2', 'DB3', 'DB4'], drugbank_targets, node_index)
+
+    def test_ties_resolve_to_first_target(self):
+        scores, nodes = madss_scoring.best_targets(self.incidence, [[1.0], [2.0], [2.0]])
+        self.assertEqual(nodes[:,0].tolist(), [1, 0, 2, -1])
+        self.assertEqual(scores[:3,0].tolist(), [2.0, 1.0, 2.0])
+        self.assertTrue(np.isnan(scores[3,0]))
+
+    # BC of the only seed is 0/0
+    def test_nan_scores_are_passed_over(self):
+        scores, nodes = madss_scoring.best_targets(self.incidence, [[nan], [1.0], [2.0]])
+        self.assertEqual(nodes[:,0].tolist(), [2, 0, 2, -1])
+        self.assertEqual(scores[[0,2],0].tolist(), [2.0, 2.0])
+        self.assertTrue(np.isnan(scores[1,0]))
+
+    def test_all_nan_targets(self):
+        scores, nodes = madss_scoring.best_targets(self.incidence, [[nan], [nan], [nan]])
+        self.assertEqual(nodes[:,0].tolist(), [0, 0, 2, -1])
+        self.assertTrue(np.isnan(scores).all())
+
+if __name__ == '__main__':
+    unittest.main()